@@ -1,33 +1,195 @@
 import os
+import re
+import json
+import hashlib
 import time
 import base64
 import uuid 
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash
+import io
+import math
+import gzip
+import csv
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, deque
+from datetime import date, datetime, timedelta
+from functools import wraps
+from flask import Flask, Response, abort, g, has_request_context, render_template, request, redirect, session, url_for, jsonify, flash, send_from_directory, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import text
+from sqlalchemy import text, event, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as SessionBase, joinedload
+import migracoes
+
+try:
+    from PIL import Image, features as pil_features
+except ImportError:  # Sem Pillow o upload continua funcionando, só sem miniaturas
+    Image = None
+try:
+    import brotli
+except ImportError:  # Sem brotli as respostas saem só em gzip
+    brotli = None
 
 # --- CONFIGURAÇÃO ---
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'chave-super-secreta-printflow'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'printflow.db')
+# PRINTFLOW_DB aponta para outro arquivo (benchmark.py usa um banco sintético)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.environ.get('PRINTFLOW_DB', os.path.join(basedir, 'printflow.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024
+# Atrás de um proxy que entenda X-Sendfile (Apache mod_xsendfile), o proxy manda o arquivo
+app.config['USE_X_SENDFILE'] = os.environ.get('PRINTFLOW_X_SENDFILE') == '1'
+# Pool dimensionado para as threads do Waitress (as conexões de /eventos não seguram conexão de banco)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 30,
+    'connect_args': {'timeout': 15, 'check_same_thread': False},
+}
+# Pragmas aplicados em toda conexão nova do SQLite:
+# WAL deixa leitores e o escritor trabalharem ao mesmo tempo; busy_timeout espera o lock
+# em vez de estourar "database is locked"; cache (KiB, negativo) e mmap (bytes) seguram
+# as páginas quentes em memória.
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 15000,
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
 
 db = SQLAlchemy(app)
+
+def configurar_sqlite(dbapi_conn, connection_record, pragmas=None):
+    cursor = dbapi_conn.cursor()
+    for nome, valor in (pragmas or app.config['SQLITE_PRAGMAS']).items():
+        cursor.execute(f'PRAGMA {nome} = {valor}')
+    cursor.close()
+
+with app.app_context():
+    event.listen(db.engine, 'connect', configurar_sqlite)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# --- BARRAMENTO DE EVENTOS (PUSH PARA OS NAVEGADORES) ---
+class BarramentoEventos:
+    """Cópia em memória do log `alteracoes`. Quem escuta fica parado na Condition
+    até chegar algo novo, então cliente ocioso não gera consulta nenhuma.
+
+    O banco é a fonte da verdade: o evento é gravado no mesmo commit da alteração
+    (registrar_evento) e o número da linha é a versão. Depois do commit local, ou
+    quando o vigia percebe linhas gravadas por outro processo, sincronizar() traz
+    as linhas novas e acorda os clientes."""
+
+    RETENCAO = 10000  # linhas mantidas no log; clientes mais atrasados que isso recarregam
+
+    def __init__(self, historico=500):
+        self._cond = threading.Condition()
+        self._eventos = deque(maxlen=historico)
+        self._vigia = None
+        self.seq = None
+
+    def sincronizar(self):
+        with db.engine.connect() as conn:
+            if self.seq is None:
+                # Primeira vez no processo: carrega o fim do log como histórico
+                linhas = conn.execute(text('SELECT id, tipo, dados FROM alteracoes ORDER BY id DESC LIMIT :n'), {'n': self._eventos.maxlen}).fetchall()[::-1]
+            else:
+                linhas = conn.execute(text('SELECT id, tipo, dados FROM alteracoes WHERE id > :seq ORDER BY id'), {'seq': self.seq}).fetchall()
+            with self._cond:
+                if self.seq is None: self.seq = linhas[0][0] - 1 if linhas else 0
+                if not linhas: return
+                anterior = self.seq
+                for id_, tipo, dados in linhas:
+                    if id_ <= self.seq: continue
+                    self._eventos.append((id_, tipo, json.loads(dados or '{}'))); self.seq = id_
+                self._cond.notify_all()
+            if self.seq // 1000 > anterior // 1000:
+                conn.execute(text('DELETE FROM alteracoes WHERE id <= :limite'), {'limite': self.seq - self.RETENCAO}); conn.commit()
+
+    def iniciar_vigia(self, intervalo=1.0):
+        """Thread que olha o log a cada `intervalo` s para pegar eventos de outros processos."""
+        with self._cond:
+            if self._vigia: return
+            def vigiar():
+                while True:
+                    time.sleep(intervalo)
+                    try:
+                        with app.app_context(): self.sincronizar()
+                    except Exception as e: print(f"Erro ao sincronizar eventos: {e}")
+            self._vigia = threading.Thread(target=vigiar, name='vigia-eventos', daemon=True)
+            self._vigia.start()
+
+    def instantaneo(self, desde):
+        """Retorna (seq_atual, eventos com seq > desde) sem esperar.
+        Se o cliente ficou para trás além do histórico, os eventos vêm como None."""
+        with self._cond:
+            if self._eventos and self._eventos[0][0] > desde + 1:
+                return self.seq, None
+            return self.seq, [e for e in self._eventos if e[0] > desde]
+
+    def aguardar(self, desde, timeout=15):
+        """Como instantaneo(), mas espera até `timeout` segundos por algo novo."""
+        with self._cond:
+            if self.seq <= desde:
+                self._cond.wait(timeout)
+            return self.instantaneo(desde)[1]
+
+BARRAMENTO = BarramentoEventos()
+
+def registrar_evento(tipo, **dados):
+    """Coloca o evento na sessão atual: ele é gravado (e numerado) no mesmo commit da alteração."""
+    db.session.add(Alteracao(tipo=tipo, dados=json.dumps(dados)))
+    db.session.info['evento_pendente'] = True
+
+@event.listens_for(SessionBase, 'after_commit')
+def _avisar_apos_commit(session):
+    if session.info.pop('evento_pendente', False):
+        BARRAMENTO.sincronizar()
+
+@event.listens_for(SessionBase, 'after_rollback')
+def _descartar_evento(session):
+    session.info.pop('evento_pendente', None)
+
 # --- CONTROLE DE VERSÃO ---
-ULTIMA_ATUALIZACAO = time.time()
-def atualizar_versao():
-    global ULTIMA_ATUALIZACAO
-    ULTIMA_ATUALIZACAO = time.time()
+# Cada alteração do quadro vira um evento 'board' com a operação, o card e os campos
+# alterados; o id da linha em `alteracoes` é a versão usada em /api/board/changes.
+# Chamar ANTES do commit, para a versão subir na mesma transação da alteração.
+def atualizar_versao(op='estrutura', card_id=None, campos=None, card_ids=None, campos_por_card=None):
+    dados = {'op': op}
+    if card_id is not None: dados['card_id'] = card_id
+    if campos_por_card: card_ids = sorted(campos_por_card)
+    if card_ids: dados['card_ids'] = list(card_ids)  # operação em lote: um evento só para vários cards
+    if campos: dados['campos'] = sorted(campos)
+    # Lote com campos diferentes por card: {id: campos} (chave em texto, por ser JSON)
+    if campos_por_card: dados['campos_por_card'] = {str(i): sorted(c) for i, c in campos_por_card.items()}
+    registrar_evento('board', **dados)
+
+def campos_alterados(obj):
+    """Nomes das colunas com alteração pendente no objeto (antes do commit)."""
+    estado = db.inspect(obj)
+    return {a.key for a in estado.mapper.column_attrs if estado.attrs[a.key].history.has_changes()}
+
+# Datas são colunas Date/DateTime (migração 011); para fora saem em ISO, que é o que o JS e
+# o <input type="date"> esperam (o jsonify padrão mandaria no formato HTTP).
+def ler_data(valor):
+    """'YYYY-MM-DD' do formulário -> date; vazio ou inválido -> None."""
+    try: return date.fromisoformat(valor) if valor else None
+    except ValueError: return None
+
+def data_iso(valor):
+    return valor.isoformat() if valor else None
+
+def formatar_data_hora(valor, formato='%d/%m/%Y %H:%M'):
+    return valor.strftime(formato) if valor else None
 
 # --- TABELA DE ASSOCIAÇÃO (USUARIO <-> SETOR) ---
 usuario_setores = db.Table('usuario_setores',
@@ -54,6 +216,8 @@ class Usuario(UserMixin, db.Model):
     def get_id(self): return str(self.id)
     @property
     def is_admin(self): return self.funcao == 'admin'
+    @property
+    def setores_ids(self): return [s.id for s in self.acessos]
     def check_password(self, password):
         try: return check_password_hash(self.senha, password)
         except: return self.senha == password
@@ -74,36 +238,132 @@ class Status(db.Model):
 
 class Card(db.Model):
     __tablename__ = 'cards'
+    # Mesmos índices das migrações 002/003 (quadro, dashboard, referências de imagem)
+    __table_args__ = (
+        db.Index('ix_cards_board', 'is_archived', 'setor_id', 'prazo'),
+        db.Index('ix_cards_status', 'is_archived', 'status_id'),
+        db.Index('ix_cards_prazo', 'is_archived', 'prazo'),
+        db.Index('ix_cards_imagem', 'imagem_path'),  # contagem de referências dos blobs
+        db.Index('ix_cards_criacao', 'data_criacao'),
+        {'sqlite_autoincrement': True},  # o id de um card arquivado nunca volta a ser usado
+    )
     id = db.Column(db.Integer, primary_key=True)
     titulo = db.Column(db.String(100), nullable=False)
     descricao = db.Column(db.Text, nullable=True)
     cliente = db.Column(db.String(100), nullable=True)
     imagem_path = db.Column(db.Text, nullable=True)
-    data_criacao = db.Column(db.String(50))
+    imagem_variantes = db.Column(db.Boolean)  # thumb/media gerados (gravado no upload; o quadro não olha o disco)
+    data_criacao = db.Column(db.DateTime, default=datetime.now)
     setor_id = db.Column(db.Integer, db.ForeignKey('setores.id'))
     status_id = db.Column(db.Integer, db.ForeignKey('status.id'))
     status_ref = db.relationship('Status', lazy=True)
     created_by = db.Column(db.String(100))
     is_archived = db.Column(db.Boolean, default=False)
-    prazo = db.Column(db.String(20))
+    prazo = db.Column(db.Date)
+    arquivado_em = db.Column(db.DateTime)  # filtro por período no arquivo
     
     # RELACIONAMENTO: Comentários do Card (NOVO)
     comentarios = db.relationship('Comentario', backref='card', lazy=True, cascade="all, delete-orphan")
 
 class Comentario(db.Model):
     __tablename__ = 'comentarios'
+    __table_args__ = (db.Index('ix_comentarios_card', 'card_id', 'data'),)
     id = db.Column(db.Integer, primary_key=True)
     card_id = db.Column(db.Integer, db.ForeignKey('cards.id'), nullable=False)
     usuario = db.Column(db.String(100))
     texto = db.Column(db.Text)
     data = db.Column(db.DateTime, default=datetime.now)
 
+# Arquivo frio (migração 010): ao arquivar, o card e os comentários saem de `cards`/`comentarios`
+# e vêm para cá com o mesmo id. Quadro, dashboard e polling só leem as tabelas quentes, que
+# ficam pequenas; arquivo, busca e restauração enxergam as duas.
+class CardArquivo(db.Model):
+    __tablename__ = 'cards_arquivo'
+    __table_args__ = (
+        db.Index('ix_cards_arquivo_data', 'arquivado_em'),
+        db.Index('ix_cards_arquivo_setor', 'setor_id'),
+        db.Index('ix_cards_arquivo_criador', 'created_by'),
+        db.Index('ix_cards_arquivo_imagem', 'imagem_path'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    titulo = db.Column(db.String(100), nullable=False)
+    descricao = db.Column(db.Text, nullable=True)
+    cliente = db.Column(db.String(100), nullable=True)
+    imagem_path = db.Column(db.Text, nullable=True)
+    imagem_variantes = db.Column(db.Boolean)  # thumb/media gerados (gravado no upload; o quadro não olha o disco)
+    data_criacao = db.Column(db.DateTime, default=datetime.now)
+    setor_id = db.Column(db.Integer, db.ForeignKey('setores.id'))
+    status_id = db.Column(db.Integer, db.ForeignKey('status.id'))
+    setor_ref = db.relationship('Setor', lazy=True)
+    status_ref = db.relationship('Status', lazy=True)
+    created_by = db.Column(db.String(100))
+    is_archived = db.Column(db.Boolean, default=True)
+    prazo = db.Column(db.Date)
+    arquivado_em = db.Column(db.DateTime)
+    comentarios = db.relationship('ComentarioArquivo', lazy=True, cascade="all, delete-orphan")
+
+# Filtro "cliente começa com" do arquivo (arquivados_filtrados): o LIKE do SQLite ignora caixa, e só
+# usa índice se ele também ignorar (migração 013)
+db.Index('ix_cards_arquivo_cliente', db.collate(CardArquivo.cliente, 'NOCASE'))
+
+class ComentarioArquivo(db.Model):
+    __tablename__ = 'comentarios_arquivo'
+    __table_args__ = (db.Index('ix_comentarios_arquivo_card', 'card_id', 'data'),)
+    id = db.Column(db.Integer, primary_key=True)
+    card_id = db.Column(db.Integer, db.ForeignKey('cards_arquivo.id'), nullable=False)
+    usuario = db.Column(db.String(100))
+    texto = db.Column(db.Text)
+    data = db.Column(db.DateTime, default=datetime.now)
+
 class Mensagem(db.Model):
     __tablename__ = 'mensagens'
+    __table_args__ = (db.Index('ix_mensagens_data', 'data_envio'),)
     id = db.Column(db.Integer, primary_key=True)
     usuario = db.Column(db.String(100))
     texto = db.Column(db.Text)
-    data_envio = db.Column(db.String(50))
+    data_envio = db.Column(db.DateTime, default=datetime.now)
+
+class Alteracao(db.Model):
+    # Log de eventos compartilhado entre processos (versão do quadro, chat, anotações)
+    __tablename__ = 'alteracoes'
+    __table_args__ = (
+        db.Index('ix_alteracoes_tipo', 'tipo', 'id'),
+        {'sqlite_autoincrement': True},  # ids nunca reaproveitados após a limpeza
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)
+    dados = db.Column(db.Text)
+    data = db.Column(db.DateTime, default=datetime.now)
+
+class Armazenamento(db.Model):
+    # Linha única (id=1) com o total ocupado em static/uploads, mantido por incremento
+    __tablename__ = 'armazenamento'
+    id = db.Column(db.Integer, primary_key=True)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    arquivos = db.Column(db.Integer, nullable=False, default=0)
+    reconciliado_em = db.Column(db.DateTime)
+
+class Tarefa(db.Model):
+    # Estado das tarefas em segundo plano (limpeza, reconciliação, exportação)
+    __tablename__ = 'tarefas'
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # pendente/executando/concluida/erro
+    parametros = db.Column(db.Text)
+    progresso = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    cursor = db.Column(db.Integer)  # último id processado: é daqui que a tarefa retoma
+    resultado = db.Column(db.Text)
+    erro = db.Column(db.Text)
+    dono = db.Column(db.String(100))  # host:pid que está executando
+    criado_por = db.Column(db.String(100))
+    criado_em = db.Column(db.DateTime, default=datetime.now)
+    atualizado_em = db.Column(db.DateTime, default=datetime.now)
+
+    def to_dict(self):
+        return {'id': self.id, 'tipo': self.tipo, 'status': self.status, 'progresso': self.progresso, 'total': self.total,
+                'resultado': json.loads(self.resultado or '{}'), 'erro': self.erro, 'criado_por': self.criado_por,
+                'criado_em': self.criado_em.strftime("%d/%m %H:%M") if self.criado_em else None}
 
 class Material(db.Model):
     __tablename__ = 'materiais'
@@ -116,51 +376,538 @@ class Material(db.Model):
 
 class Movimentacao(db.Model):
     __tablename__ = 'movimentacoes'
+    __table_args__ = (
+        db.Index('ix_movimentacoes_material_data', 'material_id', 'data'),
+        db.Index('ix_movimentacoes_chave', 'chave', unique=True),  # migração 008
+    )
     id = db.Column(db.Integer, primary_key=True)
     material_id = db.Column(db.Integer, db.ForeignKey('materiais.id'), nullable=False)
     tipo = db.Column(db.String(20), nullable=False)
     quantidade = db.Column(db.Float, nullable=False)
     usuario = db.Column(db.String(100))
     data = db.Column(db.DateTime, default=datetime.now)
+    chave = db.Column(db.String(64))  # idempotência: reenvio com a mesma chave não baixa duas vezes
+
+class ConsumoDiario(db.Model):
+    # Resumo das SAÍDAS por material e dia, mantido por gatilho em movimentacoes (migração 009)
+    __tablename__ = 'consumo_diario'
+    material_id = db.Column(db.Integer, primary_key=True)
+    dia = db.Column(db.String(10), primary_key=True)  # AAAA-MM-DD
+    quantidade = db.Column(db.Float, nullable=False, default=0)
+
+# --- CACHE DO USUÁRIO LOGADO ---
+# Toda requisição autenticada carregava o Usuario e, pelo lazy='subquery', os setores dele:
+# duas consultas só para saber quem é. O user_loader devolve agora uma cópia leve (sem
+# sessão do SQLAlchemy) guardada por USUARIO_CACHE_SEGUNDOS; salvar/excluir usuário ou
+# excluir setor invalidam na hora. Outros processos enxergam a mudança ao fim do TTL.
+app.config.setdefault('USUARIO_CACHE_SEGUNDOS', 60)
+
+class UsuarioSessao(UserMixin):
+    """Retrato do usuário para current_user: só os campos que as rotas e templates leem."""
+    def __init__(self, u):
+        self.id, self.username, self.funcao, self.acesso_estoque = u.id, u.username, u.funcao, bool(u.acesso_estoque)
+        self.setores_ids = u.setores_ids
+    @property
+    def is_admin(self): return self.funcao == 'admin'
+
+_cache_usuarios = {}
+_trava_usuarios = threading.Lock()
+
+def invalidar_usuario(user_id=None):
+    """Tira um usuário do cache (ou todos, sem id)."""
+    with _trava_usuarios:
+        if user_id is None: _cache_usuarios.clear()
+        else: _cache_usuarios.pop(int(user_id), None)
 
 @login_manager.user_loader
-def load_user(user_id): return Usuario.query.get(int(user_id))
+def load_user(user_id):
+    user_id, agora = int(user_id), time.time()
+    item = _cache_usuarios.get(user_id)
+    if item and item[0] > agora: return item[1]
+    u = Usuario.query.get(user_id)
+    if u is None: return None
+    retrato = UsuarioSessao(u)
+    with _trava_usuarios: _cache_usuarios[user_id] = (agora + app.config['USUARIO_CACHE_SEGUNDOS'], retrato)
+    return retrato
+
+def sessao_autenticada(f):
+    """Como login_required, mas só confere o id na sessão: para rotas leves que não usam current_user."""
+    @wraps(f)
+    def verificar(*args, **kwargs):
+        if not session.get('_user_id'): return jsonify({'error': 'Não autenticado'}), 401
+        return f(*args, **kwargs)
+    return verificar
+
+def setores_visiveis(todos_setores):
+    """Filtra os setores pelas permissões do usuário logado (sem acessos = vê tudo)."""
+    if current_user.is_admin or len(current_user.setores_ids) == 0:
+        return todos_setores
+    ids_permitidos = current_user.setores_ids
+    return [s for s in todos_setores if s.id in ids_permitidos]
+
+# --- IMAGENS DOS CARDS ---
+UPLOAD_FOLDER = os.path.join(basedir, 'static', 'uploads')
+# Variantes geradas no upload: nome -> (lado maior em px, qualidade). O quadro usa a
+# 'thumb', o modal a 'media'; o original só é baixado quando alguém pede.
+VARIANTES_IMAGEM = {'thumb': (320, 70), 'media': (1280, 80)}
+FORMATO_VARIANTE = ('WEBP', 'webp') if Image and pil_features.check('webp') else ('JPEG', 'jpg')
+EXTENSOES_IMAGEM = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/webp': 'webp', 'image/gif': 'gif', 'image/bmp': 'bmp'}
+
+def nome_variante(filename, variante):
+    return f"{os.path.splitext(filename)[0]}_{variante}.{FORMATO_VARIANTE[1]}"
+
+def gerar_variantes(filename):
+    """Gera as variantes comprimidas ao lado do original. Falha aqui nunca derruba o upload."""
+    if Image is None: return
+    try:
+        with Image.open(os.path.join(UPLOAD_FOLDER, filename)) as img:
+            img = img.convert('RGBA' if 'A' in img.getbands() and FORMATO_VARIANTE[0] == 'WEBP' else 'RGB')
+            for variante, (lado, qualidade) in VARIANTES_IMAGEM.items():
+                copia = img.copy(); copia.thumbnail((lado, lado))
+                copia.save(os.path.join(UPLOAD_FOLDER, nome_variante(filename, variante)), FORMATO_VARIANTE[0], quality=qualidade)
+    except Exception as e: print(f"Erro ao gerar miniaturas de {filename}: {e}")
+
+def tem_variantes(filename):
+    """Confere no disco se as variantes existem: só no upload e na carga inicial, nunca ao renderizar."""
+    return bool(filename) and all(os.path.exists(os.path.join(UPLOAD_FOLDER, nome_variante(filename, v))) for v in VARIANTES_IMAGEM)
+
+@app.template_global()
+def variante_imagem(card, variante):
+    """Nome do arquivo da variante do card, ou None se ela não existe (upload antigo / sem Pillow)."""
+    if not (card.imagem_path and card.imagem_variantes): return None
+    return nome_variante(card.imagem_path, variante)
+
+def conferir_variantes():
+    """Preenche imagem_variantes onde ainda é NULL (bancos de antes da coluna): um stat por imagem, uma vez."""
+    for tabela in ('cards', 'cards_arquivo'):
+        nomes = [n for (n,) in db.session.execute(text(f'SELECT DISTINCT imagem_path FROM {tabela} WHERE imagem_path IS NOT NULL AND imagem_variantes IS NULL'))]
+        for nome in nomes:
+            db.session.execute(text(f'UPDATE {tabela} SET imagem_variantes = :v WHERE imagem_path = :n'), {'v': tem_variantes(nome), 'n': nome})
+    db.session.commit()
+
+def arquivos_do_blob(filename):
+    """Caminhos existentes do original e das variantes."""
+    nomes = [filename] + [nome_variante(filename, v) for v in VARIANTES_IMAGEM]
+    return [c for c in (os.path.join(UPLOAD_FOLDER, n) for n in nomes) if os.path.exists(c)]
+
+def remover_imagem(filename):
+    """Apaga o original e as variantes e desconta do livro de armazenamento; devolve os bytes liberados."""
+    liberado = 0; qtd = 0
+    for caminho in arquivos_do_blob(filename):
+        liberado += os.path.getsize(caminho); os.remove(caminho); qtd += 1
+    if qtd: registrar_armazenamento(-liberado, -qtd)
+    return liberado
+
+# --- LIVRO DE ARMAZENAMENTO (static/uploads) ---
+# Total de bytes/arquivos mantido por incremento a cada gravação/remoção, para a tela de
+# configurações não varrer a pasta. reconciliar_armazenamento() recalcula do disco.
+def registrar_armazenamento(bytes_, arquivos):
+    """Soma no livro dentro da transação atual (quem chama faz o commit)."""
+    db.session.execute(text('UPDATE armazenamento SET bytes = bytes + :b, arquivos = arquivos + :n WHERE id = 1'), {'b': bytes_, 'n': arquivos})
+
+def reconciliar_armazenamento(renovar=None):
+    """`renovar` é chamado a cada pasta da varredura (a tarefa renova a concessão)."""
+    total_size = 0; total_files = 0
+    if os.path.exists(UPLOAD_FOLDER):
+        for path, dirs, files in os.walk(UPLOAD_FOLDER):
+            if renovar: renovar()
+            for f in files:
+                if f.endswith('.tmp'): continue  # upload sendo gravado por guardar_blob
+                fp = os.path.join(path, f); total_size += os.path.getsize(fp); total_files += 1
+    db.session.execute(text('UPDATE armazenamento SET bytes = :b, arquivos = :n, reconciliado_em = :agora WHERE id = 1'),
+                       {'b': total_size, 'n': total_files, 'agora': datetime.now()})
+    db.session.commit()
+    return total_size, total_files
+
+# Tarefas de conferência agendadas: tipo da tarefa -> chave de config com o intervalo em horas (0 desliga)
+TAREFAS_PERIODICAS = {'reconciliar_armazenamento': 'RECONCILIAR_ARMAZENAMENTO_HORAS', 'conferir_estoque': 'CONFERIR_ESTOQUE_HORAS'}
+
+def iniciar_tarefas_periodicas():
+    """Uma thread por tarefa periódica, que só a enfileira no intervalo configurado."""
+    def rodar(tipo, horas):
+        while True:
+            time.sleep(horas * 3600)
+            try:
+                with app.app_context(): enfileirar_tarefa(tipo, criado_por='sistema')
+            except Exception as e: print(f"Erro ao agendar {tipo}: {e}")
+    for tipo, chave in TAREFAS_PERIODICAS.items():
+        horas = app.config.get(chave, 0)
+        if horas: threading.Thread(target=rodar, args=(tipo, horas), name=f'agenda-{tipo}', daemon=True).start()
+
+# Armazenamento endereçado por conteúdo: o arquivo se chama <sha256>.<ext>, então o mesmo
+# print colado em vários cards vira um arquivo só. As referências são os próprios
+# imagem_path de cards e de cards_arquivo (índices ix_cards_imagem e ix_cards_arquivo_imagem);
+# o arquivo só sai quando ninguém mais aponta.
+# Entre guardar_blob devolver o nome e o card ser gravado existe uma janela sem referência no
+# banco: o blob fica reservado até o fim da requisição, e liberar_imagem adia (e refaz no
+# teardown) em vez de apagar. A trava vale entre as threads do processo (o Waitress é um só).
+_trava_blobs = threading.Lock()
+_blobs_reservados = Counter()
+_blobs_adiados = set()
+
+def guardar_blob(sha256, ext, gravar):
+    """Guarda o conteúdo com nome pelo hash. `gravar(caminho)` só é chamado se o blob for novo.
+    Devolve (filename, novo); novo só para quem de fato criou o arquivo (quem conta no livro)."""
+    filename = f"{sha256}.{ext}"
+    destino = os.path.join(UPLOAD_FOLDER, filename)
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    with _trava_blobs:
+        if has_request_context():
+            _blobs_reservados[filename] += 1; g.setdefault('blobs_reservados', []).append(filename)
+        if os.path.exists(destino):
+            os.utime(destino)  # mtime = último uso, que é o que a limpeza por idade olha
+            return filename, False
+    # Grava num temporário e publica com os.link, que falha se o destino já existe: com dois
+    # uploads iguais ao mesmo tempo, só um cria o arquivo e soma no livro.
+    temporario = os.path.join(UPLOAD_FOLDER, f'.{filename}.{uuid.uuid4().hex}.tmp')
+    try:
+        gravar(temporario)
+        try: os.link(temporario, destino)
+        except FileExistsError: return filename, False
+    finally:
+        if os.path.exists(temporario): os.remove(temporario)
+    if ext in EXTENSOES_IMAGEM.values() or ext in ('tif', 'tiff'): gerar_variantes(filename)
+    gravados = arquivos_do_blob(filename)
+    registrar_armazenamento(sum(os.path.getsize(c) for c in gravados), len(gravados))
+    return filename, True
+
+def contar_referencias(filename):
+    return Card.query.filter_by(imagem_path=filename).count() + CardArquivo.query.filter_by(imagem_path=filename).count()
+
+def liberar_imagem(filename, commit=True):
+    """Apaga o blob se nenhum card aponta mais para ele (chamar depois do commit, ou com commit=False
+    na mesma transação que tirou as referências)."""
+    if not filename: return 0
+    with _trava_blobs:
+        if contar_referencias(filename): return 0
+        if _blobs_reservados[filename]: _blobs_adiados.add(filename); return 0
+        liberado = remover_imagem(filename)
+    if commit: db.session.commit()
+    return liberado
+
+@app.teardown_request
+def soltar_blobs_reservados(erro=None):
+    reservados = g.pop('blobs_reservados', None)
+    if not reservados: return
+    with _trava_blobs:
+        _blobs_reservados.subtract(reservados)
+        adiados = {f for f in reservados if f in _blobs_adiados and _blobs_reservados[f] <= 0}
+        for f in set(reservados):
+            if _blobs_reservados[f] <= 0: del _blobs_reservados[f]
+        _blobs_adiados.difference_update(adiados)
+    if erro: db.session.rollback()
+    for filename in adiados:
+        try: liberar_imagem(filename)
+        except Exception as e: db.session.rollback(); print(f"Erro ao liberar {filename}: {e}")
 
 def salvar_imagem_base64(base64_string):
     if not base64_string: return None
     try:
         header, encoded = base64_string.split(",", 1); data = base64.b64decode(encoded)
-        filename = f"{uuid.uuid4()}.png"
-        folder = os.path.join(basedir, 'static', 'uploads')
-        if not os.path.exists(folder): os.makedirs(folder)
-        filepath = os.path.join(folder, filename)
-        with open(filepath, "wb") as f: f.write(data)
-        return filename
+        # Mantém o formato de origem (data:image/jpeg;base64 -> .jpg) em vez de chamar tudo de .png
+        ext = EXTENSOES_IMAGEM.get(header.split(':')[-1].split(';')[0], 'png')
+        def gravar(destino):
+            with open(destino, "wb") as f: f.write(data)
+        return guardar_blob(hashlib.sha256(data).hexdigest(), ext, gravar)[0]
     except: return None
 
+# Uploads grandes (provas em PDF/TIFF) chegam por /api/upload em streaming e ficam aqui,
+# fora do /static, até o card ser salvo com o upload_id.
+UPLOAD_PENDENTES = os.path.join(basedir, 'uploads_pendentes')
+EXTENSOES_UPLOAD = {'png', 'jpg', 'jpeg', 'webp', 'gif', 'bmp', 'tif', 'tiff', 'pdf'}
+TIPOS_UPLOAD = dict(EXTENSOES_IMAGEM, **{'image/tiff': 'tif', 'application/pdf': 'pdf'})
+BLOCO_UPLOAD = 1024 * 1024
+
+def gravar_em_blocos(origem, destino):
+    """Copia um stream para o disco em blocos, calculando tamanho e SHA-256 no caminho.
+    A memória usada é a de um bloco, seja qual for o tamanho do arquivo."""
+    sha = hashlib.sha256(); tamanho = 0
+    with open(destino, 'wb') as f:
+        while True:
+            bloco = origem.read(BLOCO_UPLOAD)
+            if not bloco: break
+            sha.update(bloco); tamanho += len(bloco); f.write(bloco)
+    return tamanho, sha.hexdigest()
+
+def limpar_uploads_pendentes(horas=24):
+    """Apaga uploads que nunca foram anexados a um card."""
+    if not os.path.exists(UPLOAD_PENDENTES): return
+    limite = time.time() - horas * 3600
+    for nome in os.listdir(UPLOAD_PENDENTES):
+        caminho = os.path.join(UPLOAD_PENDENTES, nome)
+        if os.path.getmtime(caminho) < limite: os.remove(caminho)
+
+def anexar_upload(upload_id):
+    """Move um upload pendente para static/uploads e devolve o nome final (ou None)."""
+    if not upload_id or not re.fullmatch(r'[0-9a-f]{32}', upload_id): return None
+    meta_path = os.path.join(UPLOAD_PENDENTES, upload_id + '.json')
+    if not os.path.exists(meta_path): return None
+    with open(meta_path) as f: meta = json.load(f)
+    pendente = os.path.join(UPLOAD_PENDENTES, upload_id)
+    filename, novo = guardar_blob(meta['sha256'], meta['ext'], lambda destino: os.replace(pendente, destino))
+    if os.path.exists(pendente): os.remove(pendente)  # blob já existia: gravar nem foi chamado
+    os.remove(meta_path)
+    return filename
+
+# --- MÉTRICAS ---
+# Por rota: tempo total, quantas consultas SQL e quanto tempo nelas (eventos do engine),
+# tamanho da resposta e status. /metrics expõe no formato texto do Prometheus (admin ou
+# token METRICAS_TOKEN). Requisição acima de METRICAS_LENTO_MS vai para o log com as
+# consultas mais demoradas. O hook de after_request fica antes do da compressão no
+# arquivo para rodar depois dele (o Flask roda em ordem inversa) e medir o tamanho final.
+app.config.setdefault('METRICAS_LENTO_MS', 500)
+app.config.setdefault('METRICAS_TOKEN', os.environ.get('PRINTFLOW_METRICAS_TOKEN'))
+FAIXAS_TEMPO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metricas = {}
+_trava_metricas = threading.Lock()
+LENTAS = deque(maxlen=50)
+
+# O início fica no contexto de execução do comando: se ele falhar, after_cursor_execute não
+# roda e o contexto é descartado junto, sem deixar nada pendurado na conexão
+def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+    context._inicio_sql = time.perf_counter()
+
+def _depois_sql(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or 'metricas' not in g: return
+    duracao = time.perf_counter() - context._inicio_sql
+    m = g.metricas; m['sql'] += 1; m['sql_tempo'] += duracao
+    m['consultas'].append((duracao, statement))
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', _antes_sql)
+    event.listen(db.engine, 'after_cursor_execute', _depois_sql)
+
+@app.before_request
+def iniciar_metricas():
+    g.metricas = {'inicio': time.perf_counter(), 'sql': 0, 'sql_tempo': 0.0, 'consultas': []}
+
+@app.after_request
+def registrar_metricas(resposta):
+    m = g.pop('metricas', None)
+    if m is None: return resposta
+    duracao = time.perf_counter() - m['inicio']
+    rota = request.url_rule.rule if request.url_rule else 'sem_rota'
+    chave = (request.method, rota)
+    tamanho = resposta.calculate_content_length() or 0
+    with _trava_metricas:
+        r = _metricas.get(chave)
+        if r is None: r = _metricas[chave] = {'total': 0, 'segundos': 0.0, 'faixas': [0] * len(FAIXAS_TEMPO), 'sql': 0, 'sql_segundos': 0.0, 'bytes': 0, 'status': {}}
+        r['total'] += 1; r['segundos'] += duracao; r['sql'] += m['sql']; r['sql_segundos'] += m['sql_tempo']; r['bytes'] += tamanho
+        for i, limite in enumerate(FAIXAS_TEMPO):
+            if duracao <= limite: r['faixas'][i] += 1
+        classe = f'{resposta.status_code // 100}xx'; r['status'][classe] = r['status'].get(classe, 0) + 1
+    if duracao * 1000 >= app.config['METRICAS_LENTO_MS']:
+        piores = sorted(m['consultas'], key=lambda c: c[0], reverse=True)[:5]
+        LENTAS.append({'quando': datetime.now().strftime('%d/%m %H:%M:%S'), 'metodo': request.method, 'caminho': request.full_path.rstrip('?'),
+                       'ms': round(duracao * 1000, 1), 'sql': m['sql'], 'sql_ms': round(m['sql_tempo'] * 1000, 1),
+                       'consultas': [{'ms': round(t * 1000, 1), 'sql': ' '.join(sql.split())[:300]} for t, sql in piores]})
+        app.logger.warning("Requisição lenta: %s %s %.0f ms (%d consultas, %.0f ms em SQL)%s", request.method, request.full_path.rstrip('?'),
+                           duracao * 1000, m['sql'], m['sql_tempo'] * 1000, ''.join(f"\n  {t * 1000:.1f} ms  {' '.join(sql.split())[:300]}" for t, sql in piores))
+    return resposta
+
+def acesso_metricas():
+    token = app.config.get('METRICAS_TOKEN')
+    if token and request.headers.get('Authorization') == f'Bearer {token}': return True
+    return current_user.is_authenticated and current_user.is_admin
+
+@app.route('/metrics')
+def metrics():
+    if not acesso_metricas(): return "Negado", 403
+    linhas = []
+    def metrica(nome, tipo, ajuda):
+        linhas.extend([f'# HELP {nome} {ajuda}', f'# TYPE {nome} {tipo}'])
+    with _trava_metricas: retrato = {k: dict(v, faixas=list(v['faixas']), status=dict(v['status'])) for k, v in _metricas.items()}
+    rotulo = lambda metodo, rota: f'method="{metodo}",route="{rota}"'
+    metrica('printflow_http_request_duration_seconds', 'histogram', 'Tempo das requisições por rota')
+    for (metodo, rota), r in sorted(retrato.items()):
+        for limite, qtd in zip(FAIXAS_TEMPO, r['faixas']):
+            linhas.append(f'printflow_http_request_duration_seconds_bucket{{{rotulo(metodo, rota)},le="{limite}"}} {qtd}')
+        linhas.append(f'printflow_http_request_duration_seconds_bucket{{{rotulo(metodo, rota)},le="+Inf"}} {r["total"]}')
+        linhas.append(f'printflow_http_request_duration_seconds_sum{{{rotulo(metodo, rota)}}} {r["segundos"]:.6f}')
+        linhas.append(f'printflow_http_request_duration_seconds_count{{{rotulo(metodo, rota)}}} {r["total"]}')
+    for nome, campo, ajuda, formato in (('printflow_sql_queries_total', 'sql', 'Consultas SQL feitas pelas requisições da rota', '{}'),
+                                        ('printflow_sql_seconds_total', 'sql_segundos', 'Tempo gasto em SQL pelas requisições da rota', '{:.6f}'),
+                                        ('printflow_http_response_bytes_total', 'bytes', 'Bytes enviados (após compressão)', '{}')):
+        metrica(nome, 'counter', ajuda)
+        for (metodo, rota), r in sorted(retrato.items()):
+            linhas.append(f'{nome}{{{rotulo(metodo, rota)}}} {formato.format(r[campo])}')
+    metrica('printflow_http_responses_total', 'counter', 'Respostas por classe de status')
+    for (metodo, rota), r in sorted(retrato.items()):
+        for classe, qtd in sorted(r['status'].items()):
+            linhas.append(f'printflow_http_responses_total{{{rotulo(metodo, rota)},status="{classe}"}} {qtd}')
+    metrica('printflow_eventos_seq', 'gauge', 'Último evento conhecido do barramento')
+    linhas.append(f'printflow_eventos_seq {BARRAMENTO.seq or 0}')
+    metrica('printflow_db_conexoes_em_uso', 'gauge', 'Conexões do pool emprestadas agora')
+    linhas.append(f'printflow_db_conexoes_em_uso {db.engine.pool.checkedout()}')
+    return Response('\n'.join(linhas) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/lentas')
+def metricas_lentas():
+    if not acesso_metricas(): return jsonify({'error': 'Negado'}), 403
+    return jsonify(list(LENTAS)[::-1])
+
+# Profiler por amostragem: uma thread tira a pilha de todas as outras a cada intervalo e
+# conta as pilhas iguais (formato "dobrado" do flamegraph.pl / speedscope). Ligado e
+# desligado em tempo de execução por POST /metrics/profiler.
+class ProfilerAmostragem:
+    # Cada execução tem seu próprio Event de parada: desligar e religar logo em seguida não
+    # ressuscita a thread antiga, que ainda pode estar dormindo no intervalo
+    def __init__(self):
+        self.pilhas = {}; self.amostras = 0; self.parar = None; self.thread = None; self.trava = threading.Lock()
+
+    @property
+    def ativo(self):
+        return self.parar is not None and not self.parar.is_set()
+
+    def ligar(self, intervalo=0.01):
+        with self.trava:
+            if self.ativo: return
+            self.parar = threading.Event(); self.pilhas = {}; self.amostras = 0
+            self.thread = threading.Thread(target=self._amostrar, args=(intervalo, self.parar), name='profiler', daemon=True)
+            self.thread.start()
+
+    def desligar(self):
+        with self.trava:
+            if self.parar: self.parar.set()
+
+    def _amostrar(self, intervalo, parar):
+        proprio = threading.get_ident()
+        while not parar.is_set():
+            contagem = Counter()
+            for ident, quadro in sys._current_frames().items():
+                if ident == proprio: continue
+                pilha = []
+                while quadro is not None:
+                    pilha.append(f"{os.path.basename(quadro.f_code.co_filename)}:{quadro.f_code.co_name}")
+                    quadro = quadro.f_back
+                contagem[';'.join(reversed(pilha))] += 1
+            with self.trava:
+                if parar.is_set(): break  # desligado no meio da amostra: não suja a execução seguinte
+                for chave, qtd in contagem.items(): self.pilhas[chave] = self.pilhas.get(chave, 0) + qtd
+                self.amostras += 1
+            parar.wait(intervalo)
+
+    def dobrado(self, limite=200):
+        with self.trava: pilhas = list(self.pilhas.items())
+        return '\n'.join(f'{pilha} {qtd}' for pilha, qtd in sorted(pilhas, key=lambda p: -p[1])[:limite])
+
+PROFILER = ProfilerAmostragem()
+
+@app.route('/metrics/profiler', methods=['GET', 'POST'])
+def metricas_profiler():
+    if not acesso_metricas(): return jsonify({'error': 'Negado'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if data.get('ligar'):
+            try: intervalo_ms = int(data.get('intervalo_ms', 10))
+            except (TypeError, ValueError): return jsonify({'error': 'intervalo_ms inválido'}), 400
+            PROFILER.ligar(max(1, intervalo_ms) / 1000)
+        else: PROFILER.desligar()
+        return jsonify({'ativo': PROFILER.ativo, 'amostras': PROFILER.amostras})
+    return Response(PROFILER.dobrado(request.args.get('limite', 200, type=int)) + '\n', mimetype='text/plain')
+
+# --- COMPRESSÃO ---
+# HTML, JSON, JS e CSS saem comprimidos (brotli se instalado, senão gzip). Respostas em
+# fluxo (SSE, exportações) e arquivos enviados por send_file passam direto.
+TIPOS_COMPRIMIVEIS = ('text/html', 'text/css', 'text/csv', 'application/json', 'application/javascript', 'text/javascript', 'image/svg+xml')
+COMPRIMIR_MINIMO = 500  # bytes; abaixo disso o cabeçalho custa mais que a economia
+
+@app.after_request
+def comprimir_resposta(resposta):
+    if (resposta.status_code != 200 or resposta.direct_passthrough or resposta.is_streamed or 'Content-Encoding' in resposta.headers
+            or resposta.mimetype not in TIPOS_COMPRIMIVEIS):
+        return resposta
+    resposta.vary.add('Accept-Encoding')
+    aceitas = request.accept_encodings
+    corpo = resposta.get_data()
+    if len(corpo) < COMPRIMIR_MINIMO: return resposta
+    if brotli and aceitas['br']: resposta.set_data(brotli.compress(corpo, quality=5)); resposta.headers['Content-Encoding'] = 'br'
+    elif aceitas['gzip']: resposta.set_data(gzip.compress(corpo, compresslevel=6)); resposta.headers['Content-Encoding'] = 'gzip'
+    return resposta
+
+# --- ARQUIVOS ESTÁTICOS ---
+# Uploads e sons têm rota própria (mais específica que a /static padrão do Flask). Os uploads
+# são <sha256>.<ext> e nunca são regravados, então vão com cache de um ano + immutable e o
+# próprio hash como ETag forte. send_file responde Range/If-None-Match e entrega o arquivo pelo
+# wsgi.file_wrapper: no Waitress quem envia os bytes é o laço de I/O, não a thread de trabalho.
+CACHE_UPLOADS_SEGUNDOS = 365 * 24 * 3600
+CACHE_SONS_SEGUNDOS = 7 * 24 * 3600
+PASTA_SONS = os.path.join(basedir, 'static', 'sounds')
+
+@app.route('/static/uploads/<path:filename>')
+def servir_upload(filename):
+    resposta = send_from_directory(UPLOAD_FOLDER, filename, max_age=CACHE_UPLOADS_SEGUNDOS, conditional=True,
+                                   etag=os.path.splitext(os.path.basename(filename))[0])
+    resposta.cache_control.immutable = True
+    return resposta
+
+@app.route('/static/sounds/<path:filename>')
+def servir_som(filename):
+    return send_from_directory(PASTA_SONS, filename, max_age=CACHE_SONS_SEGUNDOS, conditional=True)
+
 # --- ROTAS PRINCIPAIS ---
 
 @app.route('/verificar_atualizacao')
+@sessao_autenticada
 def verificar_atualizacao():
     ultimo_msg = Mensagem.query.order_by(Mensagem.id.desc()).first()
     msg_id = ultimo_msg.id if ultimo_msg else 0
     last_card = Card.query.order_by(Card.id.desc()).first()
     card_id = last_card.id if last_card else 0
-    return jsonify({'timestamp': ULTIMA_ATUALIZACAO, 'chat_id': msg_id, 'last_card_id': card_id})
+    return jsonify({'timestamp': versao_quadro(), 'chat_id': msg_id, 'last_card_id': card_id})
+
+@app.route('/eventos')
+@login_required
+def eventos():
+    # Server-Sent Events: o navegador reconecta sozinho mandando o Last-Event-ID
+    ultimo = request.headers.get('Last-Event-ID', type=int)
+    BARRAMENTO.sincronizar(); BARRAMENTO.iniciar_vigia()
+    def gerar(desde):
+        yield 'retry: 3000\n\n'
+        if desde is None: desde = BARRAMENTO.seq
+        elif desde > BARRAMENTO.seq:
+            # Banco foi recriado: a numeração voltou do zero
+            desde = BARRAMENTO.seq
+            yield f'id: {desde}\nevent: board\ndata: {{"recarregar": true}}\n\n'
+        while True:
+            novos = BARRAMENTO.aguardar(desde)
+            if novos is None:
+                desde = BARRAMENTO.seq
+                yield f'id: {desde}\nevent: board\ndata: {{"recarregar": true}}\n\n'
+                continue
+            if not novos:
+                yield ': ping\n\n'; continue
+            for seq, tipo, dados in novos:
+                desde = seq
+                yield f'id: {seq}\nevent: {tipo}\ndata: {json.dumps(dados)}\n\n'
+    return Response(gerar(ultimo), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/chat/enviar', methods=['POST'])
 @login_required
 def enviar_mensagem():
     data = request.get_json()
-    db.session.add(Mensagem(usuario=current_user.username, texto=data.get('texto'), data_envio=datetime.now().strftime("%H:%M")))
-    db.session.commit()
+    m = Mensagem(usuario=current_user.username, texto=data.get('texto'), data_envio=datetime.now())
+    db.session.add(m); db.session.flush()
+    registrar_evento('chat', id=m.id); db.session.commit()
     return jsonify({'success': True})
 
+CHAT_PAGINA = 50
+
 @app.route('/chat/listar')
 @login_required
 def listar_mensagens():
-    msgs = Mensagem.query.order_by(Mensagem.id.asc()).all()[-50:]
-    return jsonify([{'usuario': m.usuario, 'texto': m.texto, 'hora': m.data_envio, 'eu_mesmo': m.usuario == current_user.username} for m in msgs])
+    # Cursores pela PK: after_id traz só as novas (anexar), before_id a página anterior (rolar para cima).
+    # Sem cursor, as últimas CHAT_PAGINA. O LIMIT fica no SQL, então o custo não cresce com o histórico.
+    limite = max(1, min(request.args.get('limit', CHAT_PAGINA, type=int), 200))
+    after_id = request.args.get('after_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    if after_id is not None:
+        msgs = Mensagem.query.filter(Mensagem.id > after_id).order_by(Mensagem.id.asc()).limit(limite).all()
+    else:
+        q = Mensagem.query.filter(Mensagem.id < before_id) if before_id is not None else Mensagem.query
+        msgs = q.order_by(Mensagem.id.desc()).limit(limite).all()[::-1]
+    return jsonify([{'id': m.id, 'usuario': m.usuario, 'texto': m.texto, 'hora': formatar_data_hora(m.data_envio, '%H:%M'), 'eu_mesmo': m.usuario == current_user.username} for m in msgs])
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -178,28 +925,85 @@ def logout(): logout_user(); return redirect(url_for('login'))
 @app.route('/')
 @login_required
 def index():
+    # Versão lida antes das consultas: o que mudar depois chega como delta
+    BARRAMENTO.sincronizar(); board_seq = BARRAMENTO.seq
     todos_setores = Setor.query.order_by(Setor.ordem).all()
     lista_status = Status.query.all()
     
-    setores_visiveis = []
-    
     # 1. Filtra permissões
-    if current_user.is_admin:
-        setores_visiveis = todos_setores
-    else:
-        if len(current_user.acessos) > 0:
-            ids_permitidos = [s.id for s in current_user.acessos]
-            setores_visiveis = [s for s in todos_setores if s.id in ids_permitidos]
-        else:
-            setores_visiveis = todos_setores
+    visiveis = setores_visiveis(todos_setores)
+
+    # 2. Só os cards ativos dos setores visíveis, numa consulta só (status junto)
+    # ORDENAÇÃO INTELIGENTE (Prioridade no Semáforo), feita no SQL:
+    # Com Prazo primeiro (0), Sem Prazo depois (1); dentro dos com prazo, data menor primeiro.
+    sem_prazo = db.case((Card.prazo.is_(None), 1), else_=0)
+    cards = (Card.query.options(joinedload(Card.status_ref))
+             .filter(Card.is_archived == False, Card.setor_id.in_([s.id for s in visiveis]))
+             .order_by(sem_prazo, Card.prazo, Card.id).all())
+    cards_por_setor = {s.id: [] for s in visiveis}
+    for c in cards: cards_por_setor[c.setor_id].append(c)
+
+    return render_template('index.html', setores=visiveis, cards_por_setor=cards_por_setor, lista_status=lista_status, user=current_user, board_seq=board_seq)
+
+@app.route('/api/board/changes')
+@login_required
+def alteracoes_board():
+    # Devolve só os cards que mudaram desde `since`, já renderizados, para o cliente trocar no DOM
+    BARRAMENTO.sincronizar()
+    seq, eventos = BARRAMENTO.instantaneo(request.args.get('since', 0, type=int))
+    if eventos is None: return jsonify({'seq': seq, 'recarregar': True})
+    alterados = {}
+    for _, tipo, dados in eventos:
+        if tipo != 'board': continue
+        if 'card_id' not in dados and 'card_ids' not in dados: return jsonify({'seq': seq, 'recarregar': True})
+        por_card = dados.get('campos_por_card', {})
+        for card_id in dados.get('card_ids') or [dados['card_id']]:
+            alterados.setdefault(card_id, set()).update(por_card.get(str(card_id), dados.get('campos', [])))
+    visiveis = setores_visiveis(Setor.query.order_by(Setor.ordem).all())
+    posicao = {s.id: i for i, s in enumerate(visiveis)}
+    cards = {c.id: c for c in Card.query.options(joinedload(Card.status_ref)).filter(Card.id.in_(alterados)).all()} if alterados else {}
+    resposta = []
+    for card_id, campos in alterados.items():
+        c = cards.get(card_id)
+        if not c or c.is_archived or c.setor_id not in posicao:
+            resposta.append({'id': card_id, 'op': 'remover'}); continue
+        i = posicao[c.setor_id]
+        html = render_template('_card.html', card=c, user=current_user, is_first_col=(i == 0), is_last_col=(i == len(visiveis) - 1))
+        resposta.append({'id': c.id, 'op': 'atualizar', 'setor_id': c.setor_id, 'campos': sorted(campos), 'html': html})
+    return jsonify({'seq': seq, 'cards': resposta})
 
-    # 2. ORDENAÇÃO INTELIGENTE (Prioridade no Semáforo)
-    # Ordena: Com Prazo primeiro (0), Sem Prazo depois (1).
-    # Dentro dos com prazo: Data menor (mais urgente) primeiro.
-    for setor in setores_visiveis:
-        setor.cards.sort(key=lambda card: (1 if not card.prazo else 0, card.prazo or ""))
+def versao_quadro():
+    """Id do último evento 'board' do log (ix_alteracoes_tipo: uma busca no índice)."""
+    return db.session.query(db.func.max(Alteracao.id)).filter(Alteracao.tipo == 'board').scalar() or 0
 
-    return render_template('index.html', setores=setores_visiveis, lista_status=lista_status, user=current_user)
+CAMPOS_CARD_API = ['id', 'setor_id', 'status_id', 'titulo', 'cliente', 'prazo', 'thumb', 'criado_por']
+
+@app.route('/api/board')
+@login_required
+def api_board():
+    """Quadro em JSON compacto: cada card é uma lista na ordem de `campos`.
+
+    O ETag sai da versão do quadro e das permissões do usuário; com If-None-Match igual
+    responde 304 sem consultar os cards."""
+    versao = versao_quadro()
+    permissao = 'a' if current_user.is_admin else '-'.join(map(str, sorted(current_user.setores_ids))) or 't'
+    etag = f'q{versao}-u{current_user.id}-{permissao}'
+    if request.if_none_match.contains_weak(etag):
+        r = Response(status=304); r.set_etag(etag, weak=True); r.headers['Cache-Control'] = 'private, no-cache'
+        return r
+    visiveis = setores_visiveis(Setor.query.order_by(Setor.ordem).all())
+    sem_prazo = db.case((Card.prazo.is_(None), 1), else_=0)
+    cards = (Card.query.filter(Card.is_archived == False, Card.setor_id.in_([s.id for s in visiveis]))
+             .order_by(sem_prazo, Card.prazo, Card.id).all())
+    resposta = jsonify({
+        'versao': versao,
+        'setores': [[s.id, s.nome] for s in visiveis],
+        'status': [[st.id, st.nome, st.cor] for st in Status.query.all()],
+        'campos': CAMPOS_CARD_API,
+        'cards': [[c.id, c.setor_id, c.status_id, c.titulo, c.cliente, data_iso(c.prazo), variante_imagem(c, 'thumb'), c.created_by] for c in cards],
+    })
+    resposta.set_etag(etag, weak=True); resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
 
 @app.route('/usuarios')
 @login_required
@@ -247,6 +1051,7 @@ def salvar_usuario():
             u.acessos.append(setor)
             
     db.session.commit()
+    invalidar_usuario(u.id)
     return redirect(url_for('usuarios'))
 
 @app.route('/usuario/excluir/<int:id>', methods=['POST'])
@@ -255,20 +1060,65 @@ def excluir_usuario(id):
     if not current_user.is_admin or id == current_user.id: return jsonify({'error': 'Erro'}), 400
     db.session.delete(Usuario.query.get(id))
     db.session.commit()
+    invalidar_usuario(id)
     return jsonify({'success': True})
 
 # --- KANBAN API ---
 @app.route('/api/card/<int:card_id>')
 @login_required
 def get_card_data(card_id):
-    c = Card.query.get_or_404(card_id)
-    return jsonify({'id':c.id, 'titulo':c.titulo, 'descricao':c.descricao, 'cliente':c.cliente, 'setor_id':c.setor_id, 'status_id':c.status_id, 'imagem_path':c.imagem_path, 'created_by':c.created_by, 'prazo':c.prazo})
+    c = Card.query.get(card_id) or CardArquivo.query.get_or_404(card_id)  # a busca também abre arquivados
+    return jsonify({'id':c.id, 'is_archived':bool(c.is_archived), 'titulo':c.titulo, 'descricao':c.descricao, 'cliente':c.cliente, 'setor_id':c.setor_id, 'status_id':c.status_id, 'imagem_path':c.imagem_path, 'imagem_media':variante_imagem(c, 'media'), 'created_by':c.created_by, 'prazo':data_iso(c.prazo)})
+
+# --- BUSCA (FTS5) ---
+# busca_cards é uma tabela FTS5 (migração 006) mantida por gatilhos em cards/comentarios e
+# pela troca de tabela do arquivo frio (rowid = id nas duas), então a busca pega também os
+# arquivados sem o quadro precisar renderizar nada.
+BUSCA_PAGINA = 20
+# Mesma máscara do quadro (ocultarTelefones): 4+ dígitos seguidos viram ****. Um destaque (\x02/\x03)
+# no meio do número não o separa, e os marcadores ficam para o trecho continuar balanceado.
+RE_TELEFONE = re.compile(r'\d(?:[\x02\x03]?\d){3,}')
+
+def mascarar_telefones(texto):
+    return RE_TELEFONE.sub(lambda m: '****' + re.sub(r'[^\x02\x03]', '', m.group()), texto or '')
+
+def consulta_fts(termo):
+    """Transforma o texto digitado numa consulta FTS5: cada palavra vira prefixo ("os"* "123"*), todas obrigatórias."""
+    palavras = re.findall(r'\w+', termo or '')
+    return ' '.join(f'"{p}"*' for p in palavras)
+
+@app.route('/api/busca')
+@login_required
+def api_busca():
+    consulta = consulta_fts(request.args.get('q', ''))
+    if not consulta: return jsonify({'resultados': [], 'pagina': 1, 'tem_mais': False})
+    pagina = max(1, request.args.get('pagina', 1, type=int))
+    filtros, params = '', {'q': consulta, 'limite': BUSCA_PAGINA + 1, 'offset': (pagina - 1) * BUSCA_PAGINA}
+    if request.args.get('arquivados') == '0': filtros += ' AND c.id IS NOT NULL'
+    if not (current_user.is_admin or len(current_user.setores_ids) == 0):
+        filtros += f" AND COALESCE(c.setor_id, a.setor_id) IN ({', '.join(str(i) for i in current_user.setores_ids)})"
+    # Peso por coluna no bm25: título > cliente > descrição > comentários. Marcadores \x02/\x03 no trecho
+    # para o cliente escapar o HTML antes de destacar. Cada rowid está em cards ou em cards_arquivo.
+    linhas = db.session.execute(text(f"""
+        SELECT busca_cards.rowid AS id, COALESCE(c.titulo, a.titulo) AS titulo, COALESCE(c.cliente, a.cliente) AS cliente,
+               COALESCE(c.prazo, a.prazo) AS prazo, c.id IS NULL AS is_archived, s.nome AS setor, st.nome AS status, st.cor AS cor,
+               snippet(busca_cards, -1, char(2), char(3), '…', 12) AS trecho
+        FROM busca_cards LEFT JOIN cards c ON c.id = busca_cards.rowid LEFT JOIN cards_arquivo a ON a.id = busca_cards.rowid
+        LEFT JOIN setores s ON s.id = COALESCE(c.setor_id, a.setor_id) LEFT JOIN status st ON st.id = COALESCE(c.status_id, a.status_id)
+        WHERE busca_cards MATCH :q{filtros}
+        ORDER BY bm25(busca_cards, 10.0, 6.0, 2.0, 1.0) LIMIT :limite OFFSET :offset"""), params).mappings().all()
+    resultados = [dict(l, is_archived=bool(l['is_archived'])) for l in linhas[:BUSCA_PAGINA]]
+    if not current_user.is_admin:
+        for r in resultados: r['cliente'] = mascarar_telefones(r['cliente']); r['trecho'] = mascarar_telefones(r['trecho'])
+    return jsonify({'resultados': resultados,
+                    'pagina': pagina, 'tem_mais': len(linhas) > BUSCA_PAGINA})
 
 # --- ROTAS DE COMENTÁRIOS (NOVO) ---
 @app.route('/api/comentarios/<int:card_id>')
 @login_required
 def get_comentarios(card_id):
-    comentarios = Comentario.query.filter_by(card_id=card_id).order_by(Comentario.data.asc()).all()
+    comentarios = (Comentario.query.filter_by(card_id=card_id).order_by(Comentario.data.asc()).all()
+                   or ComentarioArquivo.query.filter_by(card_id=card_id).order_by(ComentarioArquivo.data.asc()).all())
     return jsonify([{
         'usuario': c.usuario,
         'texto': c.texto,
@@ -280,36 +1130,65 @@ def get_comentarios(card_id):
 def comentar_card():
     data = request.get_json()
     if not data.get('texto'): return jsonify({'error': 'Vazio'}), 400
-    c = Comentario(card_id=data.get('card_id'), usuario=current_user.username, texto=data.get('texto'))
-    db.session.add(c); db.session.commit()
+    modelo = ComentarioArquivo if CardArquivo.query.get(data.get('card_id')) else Comentario
+    c = modelo(card_id=data.get('card_id'), usuario=current_user.username, texto=data.get('texto'))
+    db.session.add(c); registrar_evento('comentario', card_id=c.card_id); db.session.commit()
     return jsonify({'success': True})
 
+@app.route('/api/upload', methods=['POST'])
+@login_required
+def upload_arquivo():
+    # Aceita o corpo cru (fetch com o Blob, nome em ?nome=) ou multipart com o campo 'arquivo'.
+    # Nos dois casos o conteúdo vai para o disco em blocos, nunca inteiro na memória.
+    if request.mimetype == 'multipart/form-data':
+        arquivo = request.files.get('arquivo')
+        if not arquivo: return jsonify({'error': 'Arquivo ausente'}), 400
+        origem, nome, tipo = arquivo.stream, arquivo.filename or '', arquivo.mimetype
+    else:
+        origem, nome, tipo = request.stream, request.args.get('nome', ''), request.mimetype
+    ext = os.path.splitext(nome)[1].lstrip('.').lower() or TIPOS_UPLOAD.get(tipo, '')
+    if ext == 'jpeg': ext = 'jpg'
+    if ext not in EXTENSOES_UPLOAD: return jsonify({'error': 'Tipo de arquivo não permitido'}), 400
+
+    if not os.path.exists(UPLOAD_PENDENTES): os.makedirs(UPLOAD_PENDENTES)
+    limpar_uploads_pendentes()
+    upload_id = uuid.uuid4().hex
+    tamanho, sha256 = gravar_em_blocos(origem, os.path.join(UPLOAD_PENDENTES, upload_id))
+    if tamanho == 0:
+        os.remove(os.path.join(UPLOAD_PENDENTES, upload_id)); return jsonify({'error': 'Arquivo vazio'}), 400
+    meta = {'nome': nome, 'ext': ext, 'tamanho': tamanho, 'sha256': sha256}
+    with open(os.path.join(UPLOAD_PENDENTES, upload_id + '.json'), 'w') as f: json.dump(meta, f)
+    return jsonify({'success': True, 'upload_id': upload_id, 'tamanho': tamanho, 'sha256': sha256})
+
 @app.route('/adicionar', methods=['POST'])
 @login_required
 def adicionar():
     if not current_user.is_admin: return "Negado", 403
-    img = salvar_imagem_base64(request.form.get('imagem_base64'))
+    img = anexar_upload(request.form.get('upload_id')) or salvar_imagem_base64(request.form.get('imagem_base64'))
     s = Setor.query.order_by(Setor.ordem).first()
     st = Status.query.first()
-    c = Card(titulo=request.form.get('titulo'), cliente=request.form.get('cliente'), descricao=request.form.get('descricao'), data_criacao=datetime.now().strftime("%d/%m %H:%M"), setor_id=s.id, status_id=st.id, imagem_path=img, created_by=current_user.username, prazo=request.form.get('prazo'))
-    db.session.add(c); db.session.commit(); atualizar_versao()
+    c = Card(titulo=request.form.get('titulo'), cliente=request.form.get('cliente'), descricao=request.form.get('descricao'), data_criacao=datetime.now(), setor_id=s.id, status_id=st.id, imagem_path=img, imagem_variantes=tem_variantes(img), created_by=current_user.username, prazo=ler_data(request.form.get('prazo')))
+    db.session.add(c); db.session.flush(); atualizar_versao('criar', c.id); db.session.commit()
     return redirect(url_for('index'))
 
 @app.route('/editar', methods=['POST'])
 @login_required
 def editar():
-    c = Card.query.get(request.form.get('id'))
+    c = Card.query.get(request.form.get('id')) or CardArquivo.query.get(request.form.get('id'))
     if c:
+        imagem_anterior = c.imagem_path
         if request.form.get('status_id'): c.status_id = int(request.form.get('status_id'))
         if request.form.get('setor_id'): c.setor_id = int(request.form.get('setor_id'))
         if current_user.is_admin:
             c.titulo = request.form.get('titulo')
             c.cliente = request.form.get('cliente')
             c.descricao = request.form.get('descricao')
-            c.prazo = request.form.get('prazo')
-            img = salvar_imagem_base64(request.form.get('imagem_base64'))
-            if img: c.imagem_path = img
-        db.session.commit(); atualizar_versao()
+            c.prazo = ler_data(request.form.get('prazo'))
+            img = anexar_upload(request.form.get('upload_id')) or salvar_imagem_base64(request.form.get('imagem_base64'))
+            if img: c.imagem_path = img; c.imagem_variantes = tem_variantes(img)
+        campos = campos_alterados(c)
+        atualizar_versao('editar', c.id, campos); db.session.commit()
+        if imagem_anterior != c.imagem_path: liberar_imagem(imagem_anterior)
     return redirect(url_for('index'))
 
 @app.route('/mover', methods=['POST'])
@@ -319,36 +1198,76 @@ def mover():
     if c:
         if 'setor_id' in data: c.setor_id = data.get('setor_id')
         if 'status_id' in data: c.status_id = data.get('status_id')
-        db.session.commit(); atualizar_versao()
+        campos = campos_alterados(c)
+        atualizar_versao('mover', c.id, campos); db.session.commit()
         return jsonify({'success': True})
     return jsonify({'error': 'Erro'}), 404
 
+OPERACOES_LOTE = {'mover', 'arquivar', 'desarquivar'}
+LOTE_MAXIMO = 500
+
+@app.route('/api/cards/batch', methods=['POST'])
+@login_required
+def cards_em_lote():
+    """Várias operações em cards numa transação, com um evento só no log (um delta para as telas).
+
+    Corpo: {"operacoes": [{"id": 1, "op": "mover", "setor_id": 2, "status_id": 3}, {"id": 5, "op": "arquivar"}]}"""
+    operacoes = (request.get_json(silent=True) or {}).get('operacoes')
+    if not isinstance(operacoes, list) or not operacoes: return jsonify({'error': 'Nenhuma operação'}), 400
+    if len(operacoes) > LOTE_MAXIMO: return jsonify({'error': f'Máximo de {LOTE_MAXIMO} operações por lote'}), 400
+    if any(not isinstance(o, dict) or o.get('op') not in OPERACOES_LOTE for o in operacoes): return jsonify({'error': 'Operação inválida'}), 400
+    if any(type(o.get('id')) is not int for o in operacoes): return jsonify({'error': 'Id inválido'}), 400
+    if not current_user.is_admin and any(o['op'] != 'mover' for o in operacoes): return jsonify({'error': 'Negado'}), 403
+    # Restaurados primeiro (voltam para `cards`), para um "mover" no mesmo lote já encontrá-los
+    desarquivar = [o['id'] for o in operacoes if o['op'] == 'desarquivar']
+    restaurados = restaurar_do_arquivo(desarquivar) if desarquivar else []
+    alterados = {card_id: {'is_archived'} for card_id in restaurados}
+    nao_encontrados = [card_id for card_id in desarquivar if card_id not in restaurados]
+    cards = {c.id: c for c in Card.query.filter(Card.id.in_([o['id'] for o in operacoes if o['op'] != 'desarquivar'])).all()}
+    arquivar = []
+    try:
+        for o in operacoes:
+            if o['op'] == 'desarquivar': continue
+            c = cards.get(o['id'])
+            if not c: nao_encontrados.append(o['id']); continue
+            if o['op'] == 'mover':
+                if o.get('setor_id') is not None: c.setor_id = int(o['setor_id'])
+                if o.get('status_id') is not None: c.status_id = int(o['status_id'])
+            elif not c.is_archived: c.is_archived = True; arquivar.append(c)
+            alterados.setdefault(c.id, set()).update(campos_alterados(c))
+    except (TypeError, ValueError):
+        db.session.rollback(); return jsonify({'error': 'Setor ou status inválido'}), 400
+    mover_para_arquivo(arquivar)
+    alterados = {card_id: campos for card_id, campos in alterados.items() if campos}
+    if alterados: atualizar_versao('lote', campos_por_card=alterados)
+    db.session.commit()
+    return jsonify({'success': True, 'alterados': len(alterados), 'nao_encontrados': nao_encontrados})
+
 @app.route('/arquivar/<int:id>', methods=['POST'])
 @login_required
 def arquivar(id):
     if not current_user.is_admin: return jsonify({'error': 'Negado'}), 403
     c = Card.query.get(id)
-    if c: c.is_archived = True; db.session.commit(); atualizar_versao(); return jsonify({'success': True})
+    if c: mover_para_arquivo([c]); atualizar_versao('arquivar', id, ['is_archived']); db.session.commit(); return jsonify({'success': True})
     return jsonify({'error': 'Erro'}), 404
 
 @app.route('/excluir/<int:id>', methods=['POST'])
 @login_required
 def excluir(id):
     if not current_user.is_admin: return jsonify({'error': 'Negado'}), 403
-    db.session.delete(Card.query.get(id)); db.session.commit(); atualizar_versao(); return jsonify({'success': True})
+    c = Card.query.get(id) or CardArquivo.query.get_or_404(id); imagem = c.imagem_path
+    # No arquivo frio não há gatilho de exclusão (a restauração também apaga de lá): a busca sai aqui
+    if isinstance(c, CardArquivo): db.session.execute(text('DELETE FROM busca_cards WHERE rowid = :id'), {'id': id})
+    db.session.delete(c); atualizar_versao('excluir', id); db.session.commit()
+    liberar_imagem(imagem); return jsonify({'success': True})
 
 @app.route('/configuracoes')
 @login_required
 def configuracoes():
     if not current_user.is_admin: return redirect(url_for('index'))
     setores = Setor.query.order_by(Setor.ordem).all(); lista_status = Status.query.all()
-    upload_folder = os.path.join(app.root_path, 'static', 'uploads')
-    total_size = 0; total_files = 0
-    if os.path.exists(upload_folder):
-        for path, dirs, files in os.walk(upload_folder):
-            for f in files:
-                fp = os.path.join(path, f); total_size += os.path.getsize(fp); total_files += 1
-    size_mb = round(total_size / (1024 * 1024), 2)
+    livro = Armazenamento.query.get(1)
+    size_mb = round(livro.bytes / (1024 * 1024), 2); total_files = livro.arquivos
     return render_template('configuracoes.html', setores=setores, lista_status=lista_status, user=current_user, size_mb=size_mb, total_files=total_files)
 
 @app.route('/setor/adicionar', methods=['POST'])
@@ -356,135 +1275,437 @@ def configuracoes():
 def adicionar_setor():
     if not current_user.is_admin: return "Negado", 403
     u = Setor.query.order_by(Setor.ordem.desc()).first()
-    db.session.add(Setor(nome=request.form.get('nome'), ordem=(u.ordem + 1) if u else 1)); db.session.commit(); atualizar_versao()
+    db.session.add(Setor(nome=request.form.get('nome'), ordem=(u.ordem + 1) if u else 1)); atualizar_versao(); db.session.commit()
     return redirect(url_for('configuracoes'))
 
 @app.route('/setor/excluir/<int:id>', methods=['POST'])
 @login_required
 def excluir_setor(id):
     s = Setor.query.get(id)
-    if s and not s.cards: db.session.delete(s); db.session.commit(); atualizar_versao()
+    if s and not Card.query.filter_by(setor_id=id).first() and not CardArquivo.query.filter_by(setor_id=id).first(): db.session.delete(s); atualizar_versao(); db.session.commit(); invalidar_usuario()  # acessos de todos
     return redirect(url_for('configuracoes'))
 
 @app.route('/status/adicionar', methods=['POST'])
 @login_required
 def adicionar_status():
     if not current_user.is_admin: return "Negado", 403
-    db.session.add(Status(nome=request.form.get('nome'), cor=request.form.get('cor'))); db.session.commit()
+    db.session.add(Status(nome=request.form.get('nome'), cor=request.form.get('cor'))); atualizar_versao(); db.session.commit()
     return redirect(url_for('configuracoes'))
 
 @app.route('/status/excluir/<int:id>', methods=['POST'])
 @login_required
 def excluir_status(id):
     s = Status.query.get(id)
-    if s: db.session.delete(s); db.session.commit()
+    if s: db.session.delete(s); atualizar_versao(); db.session.commit()
     return redirect(url_for('configuracoes'))
 
 @app.route('/chat/limpar', methods=['POST'])
 @login_required
 def limpar_chat():
     if not current_user.is_admin: return jsonify({'error':'Negado'}), 403
-    Mensagem.query.delete(); db.session.commit(); atualizar_versao(); return jsonify({'success':True})
+    Mensagem.query.delete(); registrar_evento('chat', limpo=True); db.session.commit(); return jsonify({'success':True})
+
+# --- ARQUIVO (arquivo frio, listagem paginada e exportação) ---
+# Arquivar tira o card de `cards` (comandos SQL em migracoes.py, a mesma troca que a migração
+# 010 fez com o histórico); restaurar devolve. Tudo na transação de quem chamou.
+COLUNAS_ARQUIVO = tuple(c.name for c in CardArquivo.__table__.columns)  # as mesmas de Card
+
+def _com_ids(sql):
+    return text(sql).bindparams(bindparam('ids', expanding=True))
+
+def mover_para_arquivo(cards):
+    """Arquiva os cards (objetos de `cards` já carregados) levando-os com os comentários para o arquivo frio."""
+    if not cards: return
+    agora = datetime.now()
+    for c in cards: c.is_archived = True; c.arquivado_em = agora
+    db.session.flush()
+    for sql in migracoes.comandos_arquivar(':ids', COLUNAS_ARQUIVO): db.session.execute(_com_ids(sql), {'ids': [c.id for c in cards]})
+    for c in cards: db.session.expunge(c)  # a linha saiu de `cards` por fora do ORM
+
+def restaurar_do_arquivo(ids):
+    """Devolve para `cards` (como ativos) os ids que estão no arquivo frio; retorna os que voltaram."""
+    ids = [card_id for (card_id,) in db.session.query(CardArquivo.id).filter(CardArquivo.id.in_(ids))]
+    if ids:
+        for sql in migracoes.comandos_restaurar(':ids', COLUNAS_ARQUIVO): db.session.execute(_com_ids(sql), {'ids': ids})
+    return ids
+
+# Paginação por chave (id < cursor, do mais novo para o mais antigo): cada página custa o
+# mesmo não importa quão fundo no histórico. Os filtros usam os índices de cards_arquivo
+# (setor, período em arquivado_em, quem criou).
+ARQUIVO_PAGINA = 50
+LOTE_EXPORTACAO = 500
+
+def arquivados_filtrados(args):
+    q = CardArquivo.query
+    if args.get('cliente'):
+        # LIKE puro (sem lower()) com o prefixo escapado: vira busca por faixa em ix_cards_arquivo_cliente
+        prefixo = re.sub(r'([/%_])', r'/\1', args['cliente'].strip())
+        q = q.filter(CardArquivo.cliente.like(prefixo + '%', escape='/'))
+    if args.get('setor_id', type=int): q = q.filter(CardArquivo.setor_id == args.get('setor_id', type=int))
+    if args.get('criado_por'): q = q.filter(CardArquivo.created_by == args['criado_por'])
+    try:
+        if args.get('de'): q = q.filter(CardArquivo.arquivado_em >= datetime.strptime(args['de'], '%Y-%m-%d'))
+        if args.get('ate'): q = q.filter(CardArquivo.arquivado_em < datetime.strptime(args['ate'], '%Y-%m-%d') + timedelta(days=1))
+    except ValueError: abort(400)
+    return q
+
+def card_arquivado_dict(c):
+    return {'id': c.id, 'titulo': c.titulo, 'cliente': c.cliente, 'descricao': c.descricao, 'setor': c.setor_ref.nome if c.setor_ref else None,
+            'criado_por': c.created_by, 'data': formatar_data_hora(c.data_criacao), 'prazo': data_iso(c.prazo),
+            'arquivado_em': formatar_data_hora(c.arquivado_em, '%Y-%m-%d %H:%M')}
 
 @app.route('/api/arquivados')
 @login_required
 def api_arquivados():
-    cards = Card.query.filter_by(is_archived=True).order_by(Card.id.desc()).limit(50).all()
-    return jsonify([{'id':c.id, 'titulo':c.titulo, 'cliente':c.cliente, 'data':c.data_criacao} for c in cards])
+    limite = max(1, min(request.args.get('limite', ARQUIVO_PAGINA, type=int), 200))
+    q = arquivados_filtrados(request.args).options(joinedload(CardArquivo.setor_ref))
+    if request.args.get('cursor', type=int): q = q.filter(CardArquivo.id < request.args.get('cursor', type=int))
+    cards = q.order_by(CardArquivo.id.desc()).limit(limite + 1).all()
+    return jsonify({'cards': [card_arquivado_dict(c) for c in cards[:limite]], 'proximo': cards[limite - 1].id if len(cards) > limite else None})
+
+@app.route('/api/arquivados/exportar')
+@login_required
+def exportar_arquivados():
+    """Exporta o arquivo inteiro (com os mesmos filtros) em CSV ou JSON, gerado em lotes enquanto é enviado."""
+    if not current_user.is_admin: return jsonify({'error': 'Negado'}), 403
+    formato = request.args.get('formato', 'csv')
+    if formato not in ('csv', 'json'): return jsonify({'error': 'Formato inválido'}), 400
+    base = arquivados_filtrados(request.args)
+    colunas = ['id', 'titulo', 'cliente', 'descricao', 'setor', 'criado_por', 'data', 'prazo', 'arquivado_em']
+
+    def lotes():
+        cursor = None
+        while True:
+            q = base.options(joinedload(CardArquivo.setor_ref))
+            if cursor: q = q.filter(CardArquivo.id < cursor)
+            lote = q.order_by(CardArquivo.id.desc()).limit(LOTE_EXPORTACAO).all()
+            if not lote: return
+            yield [card_arquivado_dict(c) for c in lote]
+            cursor = lote[-1].id
+            db.session.expunge_all()  # não acumula os cards já enviados na sessão
+
+    def gerar_csv():
+        saida = io.StringIO(); escritor = csv.DictWriter(saida, fieldnames=colunas, delimiter=';')
+        saida.write('\ufeff'); escritor.writeheader()
+        for lote in lotes():
+            escritor.writerows(lote)
+            yield saida.getvalue(); saida.seek(0); saida.truncate()
+        yield saida.getvalue()
+
+    def gerar_json():
+        yield '['
+        primeiro = True
+        for lote in lotes():
+            for item in lote:
+                yield ('' if primeiro else ',') + json.dumps(item, ensure_ascii=False)
+                primeiro = False
+        yield ']'
+
+    nome = f"printflow_arquivo_{datetime.now().strftime('%Y%m%d')}.{formato}"
+    return Response(stream_with_context(gerar_csv() if formato == 'csv' else gerar_json()),
+                    mimetype='text/csv' if formato == 'csv' else 'application/json',
+                    headers={'Content-Disposition': f'attachment; filename={nome}'})
 
 @app.route('/desarquivar/<int:card_id>', methods=['POST'])
 @login_required
 def desarquivar_card(card_id):
     if not current_user.is_admin: return jsonify({'error':'Negado'}), 403
-    c = Card.query.get(card_id)
-    if c: c.is_archived = False; db.session.commit(); atualizar_versao(); return jsonify({'success':True})
+    if restaurar_do_arquivo([card_id]): atualizar_versao('desarquivar', card_id, ['is_archived']); db.session.commit(); return jsonify({'success':True})
     return jsonify({'error':'Erro'}), 404
 
 @app.route('/api/limpar_imagens', methods=['POST'])
 @login_required
 def limpar_imagens():
     if current_user.funcao != 'admin': return jsonify({'error': 'Não autorizado'}), 403
+    # Roda em segundo plano; a tela acompanha por /api/tarefas/<id>
     dias = int(request.json.get('dias', 60)) 
-    data_limite_obj = datetime.now() - timedelta(days=dias)
-    cards_arquivados = Card.query.filter_by(is_archived=True).all()
-    imagens_apagadas = 0; espaco_liberado = 0; upload_folder = os.path.join(app.root_path, 'static', 'uploads')
-    for card in cards_arquivados:
+    t = enfileirar_tarefa('limpar_imagens', criado_por=current_user.username, dias=dias)
+    return jsonify({'success': True, 'tarefa_id': t.id})
+
+# --- TAREFAS EM SEGUNDO PLANO ---
+# Manutenções longas rodam num pool de threads com o estado na tabela `tarefas`, fora da
+# thread da requisição. O trabalho anda em lotes: a cada lote o cursor (último id
+# processado) e o progresso são gravados, então uma tarefa interrompida por um
+# reinício continua de onde parou (retomar_tarefas).
+# Quem executa é o `dono` (host:pid) e atualizado_em é a concessão: cada passo a renova, e só
+# depois de TAREFA_PRAZO_MINUTOS sem renovação outro processo pode retomar a tarefa.
+TAREFAS = {}
+LOTE_TAREFA = 200
+EXECUTOR_TAREFAS = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tarefa')
+DONO_TAREFAS = f"{socket.gethostname()}:{os.getpid()}"
+app.config.setdefault('TAREFA_PRAZO_MINUTOS', 2)
+# Ids já entregues ao pool deste processo (na fila ou rodando), para não reenviar a cada leitura
+_trava_tarefas = threading.Lock()
+_tarefas_na_fila = set()
+
+PASTA_EXPORTS = os.path.join(basedir, 'exports')
+
+class TarefaPerdida(Exception):
+    """A concessão expirou e a tarefa foi retomada por outro processo."""
+
+def tarefa(tipo):
+    def registrar(func):
+        TAREFAS[tipo] = func
+        return func
+    return registrar
+
+def enfileirar_tarefa(tipo, criado_por=None, **parametros):
+    t = Tarefa(tipo=tipo, parametros=json.dumps(parametros), criado_por=criado_por)
+    db.session.add(t); db.session.commit()
+    submeter_tarefa(t.id)
+    return t
+
+def submeter_tarefa(tarefa_id):
+    with _trava_tarefas:
+        if tarefa_id in _tarefas_na_fila: return
+        _tarefas_na_fila.add(tarefa_id)
+    EXECUTOR_TAREFAS.submit(executar_tarefa, tarefa_id)
+
+def renovar_tarefa(t, status='executando', erro=None):
+    """Renova a concessão (ou encerra a tarefa com `status`) e grava as pendências de `t`.
+    Levanta TarefaPerdida se a tarefa já não é deste processo."""
+    renovou = db.session.execute(text("UPDATE tarefas SET atualizado_em = :agora, status = :status, erro = :erro "
+                                      "WHERE id = :id AND dono = :dono AND status = 'executando'"),
+                                 {'agora': datetime.now(), 'status': status, 'erro': erro, 'id': t.id, 'dono': DONO_TAREFAS}).rowcount
+    if not renovou:
+        db.session.rollback()
+        raise TarefaPerdida(t.id)
+    db.session.commit()
+
+def salvar_progresso(t, **resultado):
+    t.resultado = json.dumps(resultado)
+    renovar_tarefa(t)
+
+def executar_tarefa(tarefa_id):
+    with app.app_context():
         try:
-            if card.imagem_path:
-                caminho_arquivo = os.path.join(upload_folder, card.imagem_path)
-                if os.path.exists(caminho_arquivo):
-                    timestamp_arquivo = os.path.getmtime(caminho_arquivo)
-                    data_arquivo = datetime.fromtimestamp(timestamp_arquivo)
-                    if data_arquivo < data_limite_obj:
-                        tamanho = os.path.getsize(caminho_arquivo)
-                        os.remove(caminho_arquivo)
-                        card.imagem_path = None
-                        imagens_apagadas += 1; espaco_liberado += tamanho
-        except Exception as e: print(f"Erro ao limpar card {card.id}: {e}")
-    db.session.commit(); mb_liberados = round(espaco_liberado / (1024 * 1024), 2)
-    return jsonify({'success': True, 'qtd': imagens_apagadas, 'mb': mb_liberados})
+            # Só executa quem conseguir trocar pendente -> executando (vale entre processos)
+            pegou = db.session.execute(text("UPDATE tarefas SET status = 'executando', dono = :dono, atualizado_em = :agora WHERE id = :id AND status = 'pendente'"),
+                                       {'dono': DONO_TAREFAS, 'agora': datetime.now(), 'id': tarefa_id}).rowcount
+            db.session.commit()
+            if not pegou: return
+            t = Tarefa.query.get(tarefa_id)
+            try:
+                TAREFAS[t.tipo](t, json.loads(t.parametros or '{}'))
+                renovar_tarefa(t, status='concluida')
+            except TarefaPerdida:
+                print(f"Tarefa {tarefa_id} ({t.tipo}) retomada por outro processo")
+            except Exception as e:
+                db.session.rollback(); print(f"Erro na tarefa {tarefa_id} ({t.tipo}): {e}")
+                try: renovar_tarefa(t, status='erro', erro=str(e))
+                except TarefaPerdida: pass
+        finally:
+            db.session.remove()
+            with _trava_tarefas: _tarefas_na_fila.discard(tarefa_id)
 
-@app.route('/dashboard')
+def retomar_tarefas():
+    """Devolve para a fila as tarefas executando cuja concessão expirou (ou que são deste processo
+    mas já não estão no pool) e entrega ao pool as pendentes que ainda não estão nele."""
+    limite = datetime.now() - timedelta(minutes=app.config['TAREFA_PRAZO_MINUTOS'])
+    with _trava_tarefas: no_pool = set(_tarefas_na_fila)
+    paradas = [id_ for id_, dono, atualizado_em in
+               db.session.query(Tarefa.id, Tarefa.dono, Tarefa.atualizado_em).filter_by(status='executando')
+               if (dono == DONO_TAREFAS and id_ not in no_pool) or atualizado_em is None or atualizado_em < limite]
+    if paradas:
+        db.session.execute(_com_ids("UPDATE tarefas SET status = 'pendente', dono = NULL WHERE status = 'executando' AND id IN :ids "
+                                    "AND (dono = :dono OR atualizado_em IS NULL OR atualizado_em < :limite)"),
+                           {'ids': paradas, 'dono': DONO_TAREFAS, 'limite': limite})
+        db.session.commit()
+    for (tarefa_id,) in db.session.query(Tarefa.id).filter_by(status='pendente').order_by(Tarefa.id):
+        if tarefa_id not in no_pool: submeter_tarefa(tarefa_id)
+
+@tarefa('limpar_imagens')
+def _tarefa_limpar_imagens(t, parametros):
+    data_limite_obj = datetime.now() - timedelta(days=int(parametros.get('dias', 60)))
+    r = json.loads(t.resultado or '{}'); qtd = r.get('qtd', 0); espaco_liberado = r.get('bytes', 0)
+    base = CardArquivo.query.filter(CardArquivo.imagem_path.isnot(None))
+    if t.total is None: t.total = base.count()
+    while True:
+        lote = base.filter(CardArquivo.id > (t.cursor or 0)).order_by(CardArquivo.id).limit(LOTE_TAREFA).all()
+        if not lote: break
+        # Renova antes de mexer no lote: daqui até salvar_progresso a transação segura o lock de escrita
+        renovar_tarefa(t)
+        candidatas = set()
+        for card in lote:
+            try:
+                caminho_arquivo = os.path.join(UPLOAD_FOLDER, card.imagem_path)
+                # Arquivo que já não existe também sai: é um lote anterior que apagou e caiu antes do commit
+                if not os.path.exists(caminho_arquivo) or datetime.fromtimestamp(os.path.getmtime(caminho_arquivo)) < data_limite_obj:
+                    candidatas.add(card.imagem_path); card.imagem_path = None; card.imagem_variantes = False; qtd += 1
+            except Exception as e: print(f"Erro ao limpar card {card.id}: {e}")
+        # Só apaga o arquivo se nenhum outro card (ativo, por exemplo) usa o mesmo print. Apaga antes do
+        # commit: referências, livro e cursor vão juntos, e um lote repetido encontra o arquivo já ausente.
+        db.session.flush()
+        for filename in candidatas: espaco_liberado += liberar_imagem(filename, commit=False)
+        t.cursor = lote[-1].id; t.progresso += len(lote)
+        salvar_progresso(t, qtd=qtd, bytes=espaco_liberado)
+    salvar_progresso(t, qtd=qtd, bytes=espaco_liberado, mb=round(espaco_liberado / (1024 * 1024), 2))
+
+@tarefa('reconciliar_armazenamento')
+def _tarefa_reconciliar_armazenamento(t, parametros):
+    t.total = 1
+    total_size, total_files = reconciliar_armazenamento(renovar=lambda: renovar_tarefa(t))
+    t.progresso = 1
+    salvar_progresso(t, bytes=total_size, arquivos=total_files, mb=round(total_size / (1024 * 1024), 2))
+
+@tarefa('exportar_cards')
+def _tarefa_exportar_cards(t, parametros):
+    """CSV de todos os pedidos (ativos e arquivados) em exports/<id>.csv."""
+    if not os.path.exists(PASTA_EXPORTS): os.makedirs(PASTA_EXPORTS)
+    caminho = os.path.join(PASTA_EXPORTS, f'{t.id}.csv')
+    r = json.loads(t.resultado or '{}')
+    if t.total is None: t.total = Card.query.count() + CardArquivo.query.count()
+    # Duas fases: ativos (cards) e depois o arquivo frio; o cursor é o id dentro da fase atual
+    fases, fase = (Card, CardArquivo), r.get('fase', 0)
+    with open(caminho, 'a+', newline='', encoding='utf-8-sig') as f:
+        # Retomando: descarta o que foi escrito depois do último lote confirmado
+        f.truncate(r.get('offset', 0)); f.seek(r.get('offset', 0))
+        escritor = csv.writer(f, delimiter=';')
+        if not r.get('offset'): escritor.writerow(['id', 'titulo', 'cliente', 'descricao', 'setor', 'status', 'criado_por', 'data_criacao', 'prazo', 'arquivado'])
+        while fase < len(fases):
+            modelo = fases[fase]
+            lote = (modelo.query.options(joinedload(modelo.status_ref), joinedload(modelo.setor_ref))
+                    .filter(modelo.id > (t.cursor or 0)).order_by(modelo.id).limit(LOTE_TAREFA).all())
+            if not lote: fase += 1; t.cursor = None; continue
+            for c in lote:
+                escritor.writerow([c.id, c.titulo, c.cliente, c.descricao, c.setor_ref.nome if c.setor_ref else '',
+                                   c.status_ref.nome if c.status_ref else '', c.created_by, formatar_data_hora(c.data_criacao, '%Y-%m-%d %H:%M'), data_iso(c.prazo), 'sim' if c.is_archived else 'não'])
+            f.flush()
+            t.cursor = lote[-1].id; t.progresso += len(lote)
+            salvar_progresso(t, offset=f.tell(), arquivo=f'{t.id}.csv', fase=fase)
+
+@app.route('/api/tarefas', methods=['GET', 'POST'])
 @login_required
-def dashboard():
-    if not current_user.is_admin: return redirect(url_for('index'))
-    
-    # 1. Busca todos os dados ativos
-    all_cards = Card.query.filter_by(is_archived=False).all()
+def api_tarefas():
+    if not current_user.is_admin: return jsonify({'error': 'Negado'}), 403
+    if request.method == 'POST':
+        data = request.get_json()
+        if data.get('tipo') not in TAREFAS: return jsonify({'error': 'Tipo de tarefa desconhecido'}), 400
+        t = enfileirar_tarefa(data['tipo'], criado_por=current_user.username, **data.get('parametros', {}))
+        return jsonify({'success': True, 'tarefa_id': t.id})
+    retomar_tarefas()
+    return jsonify([t.to_dict() for t in Tarefa.query.order_by(Tarefa.id.desc()).limit(20).all()])
+
+@app.route('/api/tarefas/<int:tarefa_id>')
+@login_required
+def api_tarefa(tarefa_id):
+    if not current_user.is_admin: return jsonify({'error': 'Negado'}), 403
+    return jsonify(Tarefa.query.get_or_404(tarefa_id).to_dict())
+
+@app.route('/api/tarefas/<int:tarefa_id>/arquivo')
+@login_required
+def baixar_arquivo_tarefa(tarefa_id):
+    if not current_user.is_admin: return jsonify({'error': 'Negado'}), 403
+    t = Tarefa.query.get_or_404(tarefa_id)
+    if t.tipo != 'exportar_cards' or t.status != 'concluida': return jsonify({'error': 'Exportação não concluída'}), 404
+    return send_from_directory(PASTA_EXPORTS, f'{t.id}.csv', as_attachment=True, download_name=f'printflow_pedidos_{t.id}.csv')
+
+# Cache curto do dashboard: vale enquanto a versão do quadro (log `alteracoes`) não mudar,
+# e no máximo DASHBOARD_CACHE_SEGUNDOS (0 desliga). Gerente dando F5 não vai ao banco.
+app.config.setdefault('DASHBOARD_CACHE_SEGUNDOS', 30)
+app.config.setdefault('RECONCILIAR_ARMAZENAMENTO_HORAS', 24)
+app.config.setdefault('CONFERIR_ESTOQUE_HORAS', 24)
+_cache_dashboard = {'chave': None, 'expira': 0, 'dados': None}
+
+def calcular_dashboard():
+    """KPIs e gráficos com agregações no SQL: número fixo de consultas, seja qual for o volume."""
+    ativos = Card.is_archived == False
+    hoje = date.today()
     all_status = Status.query.all()
     all_setores = Setor.query.order_by(Setor.ordem).all()
+    por_status = dict(db.session.query(Card.status_id, db.func.count()).filter(ativos).group_by(Card.status_id).all())
+    por_setor = dict(db.session.query(Card.setor_id, db.func.count()).filter(ativos).group_by(Card.setor_id).all())
 
-    # 2. Calcula KPIs (Números do Topo)
-    total = len(all_cards)
-    atrasados = 0
-    para_hoje = 0
-    hoje_str = datetime.now().strftime('%Y-%m-%d')
-
-    for c in all_cards:
-        if c.prazo:
-            # Compara datas (string YYYY-MM-DD)
-            if c.prazo < hoje_str:
-                atrasados += 1
-            elif c.prazo == hoje_str:
-                para_hoje += 1
-
-    # 3. Prepara dados para o Gráfico de Status (Pizza)
-    labels_status = []
-    values_status = []
-    colors_status = [] # <--- A VARIÁVEL QUE FALTAVA E CAUSAVA O ERRO
-
-    for st in all_status:
-        # Conta quantos cards ativos tem nesse status
-        count = Card.query.filter_by(status_id=st.id, is_archived=False).count()
-        # Só adiciona no gráfico se tiver pelo menos 1 card (para não ficar poluído)
-        if count > 0:
-            labels_status.append(st.nome)
-            values_status.append(count)
-            colors_status.append(st.cor) # Pega a cor configurada no banco
-
-    # 4. Prepara dados para o Gráfico de Setores (Barras)
-    labels_setor = []
-    values_setor = []
-
-    for s in all_setores:
-        # Conta cards ativos neste setor
-        count = len([c for c in s.cards if not c.is_archived])
-        labels_setor.append(s.nome)
-        values_setor.append(count)
-
-    # 5. Envia tudo para o HTML (Incluindo a colors_status)
-    return render_template('dashboard.html', 
-                           user=current_user, 
-                           total=total, 
-                           atrasados=atrasados, 
-                           para_hoje=para_hoje,
-                           labels_status=labels_status, 
-                           values_status=values_status,
-                           colors_status=colors_status, # <--- CORREÇÃO AQUI
-                           labels_setor=labels_setor, 
-                           values_setor=values_setor)
+    # Prazos vencidos/para hoje: faixa (prazo <= hoje) no índice ix_cards_prazo; NULL fica de fora
+    atrasados, para_hoje = db.session.query(
+        db.func.count(db.case((Card.prazo < hoje, 1))),
+        db.func.count(db.case((Card.prazo == hoje, 1))),
+    ).filter(ativos, Card.prazo <= hoje).one()
+
+    # Gráfico de status (pizza): só status com pelo menos 1 card, para não ficar poluído
+    com_cards = [st for st in all_status if por_status.get(st.id)]
+    return {
+        'total': sum(por_status.values()),
+        'atrasados': atrasados,
+        'para_hoje': para_hoje,
+        'labels_status': [st.nome for st in com_cards],
+        'values_status': [por_status[st.id] for st in com_cards],
+        'colors_status': [st.cor for st in com_cards],
+        'labels_setor': [s.nome for s in all_setores],
+        'values_setor': [por_setor.get(s.id, 0) for s in all_setores],
+    }
+
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    if not current_user.is_admin: return redirect(url_for('index'))
+    global _cache_dashboard
+    # Só eventos 'board' (cards, setores, status): chat e comentários não invalidam
+    chave = (versao_quadro(), datetime.now().strftime('%Y-%m-%d'))
+    cache = _cache_dashboard
+    if cache['chave'] != chave or time.time() >= cache['expira']:
+        cache = {'chave': chave, 'expira': time.time() + app.config['DASHBOARD_CACHE_SEGUNDOS'], 'dados': calcular_dashboard()}
+        _cache_dashboard = cache
+    return render_template('dashboard.html', user=current_user, **cache['dados'])
 
 # --- ROTAS DE ESTOQUE ---
+# O saldo em materiais.quantidade é um valor materializado do livro `movimentacoes`. Toda
+# movimentação passa por registrar_movimentacoes: incremento no próprio UPDATE (sem ler e
+# regravar no Python) e o lançamento no livro, tudo na mesma transação.
+
+def registrar_movimentacoes(itens):
+    """Aplica as movimentações numa transação só e devolve um resultado por item: 'ok', 'repetida' (chave já usada) ou 'inexistente'.
+
+    ValueError se algum item for inválido (nada é gravado). A quantidade pode vir como texto (formulário)."""
+    for item in itens:
+        if not isinstance(item, dict): raise ValueError('Movimentação inválida')
+        if item.get('tipo') not in ('ENTRADA', 'SAIDA'): raise ValueError('Tipo inválido (use ENTRADA ou SAIDA)')
+        if type(item.get('material_id')) is not int: raise ValueError('Material inválido')
+        if not isinstance(item.get('chave', ''), (str, type(None))): raise ValueError('Chave inválida')
+        item['chave'] = (item.get('chave') or '').strip() or None  # chave vazia = sem chave (o índice é único)
+        try: item['quantidade'] = float(item.get('quantidade'))
+        except (TypeError, ValueError): raise ValueError('Quantidade inválida')
+        if not math.isfinite(item['quantidade']): raise ValueError('Quantidade inválida')
+        if item['quantidade'] <= 0: raise ValueError('Quantidade deve ser maior que zero')
+    for tentativa in range(2):
+        chaves = [i['chave'] for i in itens if i.get('chave')]
+        usadas = {m.chave for m in Movimentacao.query.filter(Movimentacao.chave.in_(chaves))} if chaves else set()
+        resultados = []
+        for item in itens:
+            chave = item.get('chave')
+            if chave and chave in usadas: resultados.append('repetida'); continue
+            delta = -item['quantidade'] if item['tipo'] == 'SAIDA' else item['quantidade']
+            if not db.session.execute(text('UPDATE materiais SET quantidade = quantidade + :delta WHERE id = :id'), {'delta': delta, 'id': item.get('material_id')}).rowcount:
+                resultados.append('inexistente'); continue
+            user_reg = f"{current_user.username} ➔ {item.get('destino')}" if item['tipo'] == 'SAIDA' else current_user.username
+            db.session.add(Movimentacao(material_id=item['material_id'], tipo=item['tipo'], quantidade=item['quantidade'], usuario=user_reg, chave=chave))
+            if chave: usadas.add(chave)
+            resultados.append('ok')
+        try:
+            db.session.commit()
+            return resultados
+        except IntegrityError:
+            # Outra requisição gravou a mesma chave entre a conferência e o commit: refaz, agora ela conta como repetida
+            db.session.rollback()
+            if tentativa: raise
+
+def conferir_estoque():
+    """Compara o saldo de cada material com a soma do livro (entradas - saídas). Uma consulta só."""
+    linhas = db.session.execute(text("""
+        SELECT m.id, m.nome, m.unidade, m.quantidade AS saldo,
+               COALESCE(SUM(CASE WHEN mv.tipo = 'SAIDA' THEN -mv.quantidade ELSE mv.quantidade END), 0) AS livro
+        FROM materiais m LEFT JOIN movimentacoes mv ON mv.material_id = m.id
+        GROUP BY m.id ORDER BY m.nome""")).mappings().all()
+    divergentes = [dict(l, diferenca=round(l['saldo'] - l['livro'], 3)) for l in linhas if abs(l['saldo'] - l['livro']) > 0.0005]
+    return {'materiais': len(linhas), 'divergentes': divergentes, 'conferido_em': datetime.now().strftime("%d/%m/%Y %H:%M")}
+
+@tarefa('conferir_estoque')
+def _tarefa_conferir_estoque(t, parametros):
+    t.total = 1
+    relatorio = conferir_estoque()
+    if relatorio['divergentes']: print(f"Estoque: {len(relatorio['divergentes'])} material(is) com saldo diferente do livro")
+    t.progresso = 1
+    salvar_progresso(t, **relatorio)
 
 @app.route('/estoque')
 @login_required
@@ -513,13 +1734,28 @@ def movimentar_estoque():
     if not current_user.is_admin and not current_user.acesso_estoque:
         return "Negado", 403
         
-    m = Material.query.get(request.form.get('id')); qtd = float(request.form.get('quantidade')); tipo = request.form.get('tipo'); dest = request.form.get('destino')
-    if m:
-        if tipo == 'SAIDA': m.quantidade -= qtd; user_reg = f"{current_user.username} ➔ {dest}"
-        else: m.quantidade += qtd; user_reg = current_user.username
-        db.session.add(Movimentacao(material=m, tipo=tipo, quantidade=qtd, usuario=user_reg)); db.session.commit()
+    try: registrar_movimentacoes([{'material_id': request.form.get('id', type=int), 'tipo': request.form.get('tipo'), 'quantidade': request.form.get('quantidade'),
+                                   'destino': request.form.get('destino'), 'chave': request.form.get('chave') or None}])
+    except ValueError as e: flash(str(e))
     return redirect(url_for('estoque'))
 
+@app.route('/api/estoque/movimentar', methods=['POST'])
+@login_required
+def movimentar_estoque_lote():
+    """Várias movimentações numa requisição e numa transação: {"movimentacoes": [{material_id, tipo, quantidade, destino?, chave?}]}."""
+    if not current_user.is_admin and not current_user.acesso_estoque: return jsonify({'error': 'Negado'}), 403
+    itens = (request.get_json(silent=True) or {}).get('movimentacoes')
+    if not isinstance(itens, list) or not itens: return jsonify({'error': 'Nenhuma movimentação'}), 400
+    try: resultados = registrar_movimentacoes(itens)
+    except ValueError as e: return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'resultados': resultados})
+
+@app.route('/api/estoque/conferencia')
+@login_required
+def api_conferencia_estoque():
+    if not current_user.is_admin: return jsonify({'error': 'Negado'}), 403
+    return jsonify(conferir_estoque())
+
 @app.route('/estoque/excluir_item/<int:id>', methods=['POST'])
 @login_required
 def excluir_item_estoque(id):
@@ -529,21 +1765,65 @@ def excluir_item_estoque(id):
     if m: db.session.delete(m); db.session.commit()
     return redirect(url_for('estoque'))
 
+# Previsão de consumo: lê só o resumo consumo_diario (uma linha por material e dia), então
+# o catálogo inteiro sai numa consulta, sem percorrer o livro de movimentações.
+@app.route('/api/estoque/previsao')
+@login_required
+def api_previsao_estoque():
+    """Consumo médio por dia na janela (?dias=30) e dias estimados até o mínimo e até zerar, para todos os materiais."""
+    if not current_user.is_admin and not current_user.acesso_estoque: return jsonify({'error': 'Negado'}), 403
+    dias = max(1, min(request.args.get('dias', 30, type=int), 365))
+    inicio = (datetime.now() - timedelta(days=dias - 1)).strftime('%Y-%m-%d')
+    linhas = db.session.execute(text("""
+        SELECT m.id, m.nome, m.unidade, m.quantidade, m.minimo, COALESCE(SUM(cd.quantidade), 0) / :dias AS consumo_dia
+        FROM materiais m LEFT JOIN consumo_diario cd ON cd.material_id = m.id AND cd.dia >= :inicio
+        GROUP BY m.id ORDER BY m.nome"""), {'dias': float(dias), 'inicio': inicio}).mappings().all()
+    def previsao(l):
+        consumo = l['consumo_dia']
+        return dict(l, consumo_dia=round(consumo, 3),
+                    dias_ate_minimo=max(0, round((l['quantidade'] - l['minimo']) / consumo, 1)) if consumo else None,
+                    dias_ate_zerar=max(0, round(l['quantidade'] / consumo, 1)) if consumo else None)
+    return jsonify({'janela_dias': dias, 'materiais': [previsao(l) for l in linhas]})
+
+@app.route('/api/estoque/consumo/<int:id>')
+@login_required
+def api_consumo_material(id):
+    """Série de consumo de um material por dia ou por semana (?agrupar=semana), nas últimas ?dias=90."""
+    if not current_user.is_admin and not current_user.acesso_estoque: return jsonify({'error': 'Negado'}), 403
+    dias = max(1, min(request.args.get('dias', 90, type=int), 730))
+    periodo = "strftime('%Y-%W', dia)" if request.args.get('agrupar') == 'semana' else 'dia'
+    linhas = db.session.execute(text(f"""
+        SELECT {periodo} AS periodo, SUM(quantidade) AS quantidade FROM consumo_diario
+        WHERE material_id = :id AND dia >= :inicio GROUP BY periodo ORDER BY periodo"""),
+        {'id': id, 'inicio': (datetime.now() - timedelta(days=dias - 1)).strftime('%Y-%m-%d')}).all()
+    return jsonify([{'periodo': p, 'quantidade': q} for p, q in linhas])
+
 @app.route('/estoque/historico/<int:id>')
 @login_required
 def historico_estoque(id):
     movs = Movimentacao.query.filter_by(material_id=id).order_by(Movimentacao.data.desc()).limit(20).all()
     return jsonify([{'tipo':m.tipo, 'qtd':m.quantidade, 'usuario':m.usuario, 'data':m.data.strftime("%d/%m %H:%M")} for m in movs])
 
+def inicializar_banco():
+    """Cria as tabelas que faltam, aplica as migrações pendentes e os dados iniciais."""
+    with app.app_context():
+        db.create_all()
+        migracoes.aplicar(db.engine)
+        # Livro de armazenamento nunca conferido (banco antigo): uma varredura só, na subida
+        if Armazenamento.query.get(1).reconciliado_em is None: reconciliar_armazenamento()
+        conferir_variantes()
+        if not Usuario.query.filter_by(username='admin').first():
+            u = Usuario(username='admin', funcao='admin'); u.set_password('admin'); db.session.add(u)
+        if not Setor.query.first(): db.session.add(Setor(nome="Atendimento", ordem=1)); db.session.add(Setor(nome="Produção", ordem=2)); db.session.add(Setor(nome="Expedição", ordem=3))
+        if not Status.query.first(): db.session.add(Status(nome="Pendente", cor="gray")); db.session.add(Status(nome="Concluído", cor="green"))
+        db.session.commit()
+
+def iniciar_segundo_plano():
+    """Retoma tarefas interrompidas e liga as conferências periódicas (servidor, não scripts)."""
+    with app.app_context(): retomar_tarefas()
+    iniciar_tarefas_periodicas()
+
 if __name__ == '__main__':
-    if not os.path.exists(os.path.join(basedir, 'printflow.db')):
-        with app.app_context():
-            db.create_all()
-            if not Usuario.query.filter_by(username='admin').first():
-                u = Usuario(username='admin', funcao='admin'); u.set_password('admin'); db.session.add(u)
-            if not Setor.query.first(): db.session.add(Setor(nome="Atendimento", ordem=1)); db.session.add(Setor(nome="Produção", ordem=2)); db.session.add(Setor(nome="Expedição", ordem=3))
-            if not Status.query.first(): db.session.add(Status(nome="Pendente", cor="gray")); db.session.add(Status(nome="Concluído", cor="green"))
-            db.session.commit()
-    else:
-        with app.app_context(): db.create_all()
+    inicializar_banco()
+    iniciar_segundo_plano()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
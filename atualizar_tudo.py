@@ -1,27 +1,15 @@
-from app import app, db
-from sqlalchemy import text
+from app import app, db, inicializar_banco
 
-print("--- INICIANDO ATUALIZAÇÃO GERAL DO BANCO DE DADOS (v4.4) ---")
+print("--- INICIANDO ATUALIZAÇÃO GERAL DO BANCO DE DADOS ---")
 
-with app.app_context():
-    # 1. Cria tabelas novas que não existem (Comentarios, Usuario_Setores, etc)
-    db.create_all()
-    print("✅ Tabelas novas verificadas/criadas.")
+# Cria tabelas novas e aplica só as migrações que ainda não rodaram (ver migracoes.py)
+inicializar_banco()
 
-    # 2. Verifica e adiciona coluna 'acesso_estoque' se faltar
-    try:
-        with db.engine.connect() as conn:
-            # Tenta selecionar a coluna para ver se existe
-            conn.execute(text("SELECT acesso_estoque FROM usuarios LIMIT 1"))
-            print("ℹ️ Coluna 'acesso_estoque' já existe.")
-    except:
-        # Se der erro, é porque não existe. Cria a coluna.
-        print("⚠️ Coluna 'acesso_estoque' ausente. Criando...")
-        with db.engine.connect() as conn:
-            conn.execute(text("ALTER TABLE usuarios ADD COLUMN acesso_estoque BOOLEAN DEFAULT 0"))
-            conn.commit()
-        print("✅ Coluna 'acesso_estoque' adicionada com sucesso.")
+with app.app_context():
+    with db.engine.connect() as conn:
+        for numero, descricao, aplicada_em in conn.execute(db.text("SELECT numero, descricao, aplicada_em FROM schema_migracoes ORDER BY numero")):
+            print(f"✅ {numero:03d} - {descricao} ({aplicada_em})")
 
 print("--- FIM DA ATUALIZAÇÃO ---")
 print("Pode fechar e iniciar o sistema.")
-input("Pressione ENTER para sair...")
\ No newline at end of file
+input("Pressione ENTER para sair...")
@@ -0,0 +1,240 @@
+"""Benchmark do PrintFlow: banco sintético de gráfica + clientes simultâneos, latência por rota.
+
+Gera (ou reaproveita) um banco com setores, cards ativos e arquivados, chat e
+movimentações de estoque, sobe o app Flask apontado para ele (PRINTFLOW_DB) e roda
+clientes simulados em threads pelo test_client, sem rede:
+
+  pollers   /verificar_atualizacao, /api/board (If-None-Match), /chat/listar?after_id
+  movers    arrastam cards entre setores (/mover) e buscam o delta (/api/board/changes)
+  chatters  mandam e leem mensagens
+  gerentes  abrem o quadro, o dashboard, a busca e o arquivo
+
+No fim imprime p50/p95/p99 e requisições/s por rota e grava tudo num JSON (com o commit
+do git e os parâmetros) para comparar uma rodada com a outra.
+
+Uso:
+  python benchmark.py                                  # tamanhos padrão (banco grande, demora para gerar)
+  python benchmark.py --ativos 500 --arquivados 5000 --mensagens 20000 --movimentacoes 10000 --segundos 10
+  python benchmark.py --banco bench.db --reaproveitar   # pula a geração se o arquivo já existir
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import migracoes
+
+LOTE_INSERCAO = 20000
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--setores', type=int, default=20)
+    parser.add_argument('--ativos', type=int, default=5000)
+    parser.add_argument('--arquivados', type=int, default=200000)
+    parser.add_argument('--mensagens', type=int, default=1000000)
+    parser.add_argument('--materiais', type=int, default=300)
+    parser.add_argument('--movimentacoes', type=int, default=500000)
+    parser.add_argument('--segundos', type=float, default=30)
+    parser.add_argument('--pollers', type=int, default=20)
+    parser.add_argument('--movers', type=int, default=4)
+    parser.add_argument('--chatters', type=int, default=4)
+    parser.add_argument('--gerentes', type=int, default=1)
+    parser.add_argument('--pausa', type=float, default=0.0, help='Segundos de espera entre requisições de cada cliente')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--banco', help='Arquivo do banco sintético (padrão: temporário, apagado no fim)')
+    parser.add_argument('--reaproveitar', action='store_true', help='Usa --banco como está se ele já existir')
+    parser.add_argument('--saida', default=f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    return parser.parse_args()
+
+# --- DADOS SINTÉTICOS ---
+
+CLIENTES = ['Padaria São João', 'Mercado Bom Preço', 'Auto Peças Silva', 'Clínica Vida', 'Escola Aprender', 'Academia Forma',
+            'Restaurante Sabor', 'Farmácia Popular', 'Imobiliária Lar', 'Pet Shop Amigo', 'Ótica Visão', 'Loja da Moda']
+SERVICOS = ['Banner lona 440g', 'Adesivo vinil recortado', 'Fachada ACM', 'Cartão de visita 4x4', 'Panfleto A5', 'Placa PVC',
+            'Wind banner', 'Envelopamento', 'Letra caixa', 'Plotagem de projeto', 'Etiqueta BOPP', 'Totem MDF']
+MATERIAIS = ['Lona', 'Vinil', 'ACM', 'PVC', 'Tinta', 'Papel couché', 'MDF', 'Acrílico', 'Ilhós', 'Bastão']
+
+def em_lotes(conn, sql, linhas):
+    lote = []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= LOTE_INSERCAO: conn.executemany(sql, lote); lote = []
+    if lote: conn.executemany(sql, lote)
+
+def gerar_banco(caminho, args):
+    """Preenche o banco já com o esquema do app (inicializar_banco) usando sqlite3 direto, em lotes."""
+    rnd = random.Random(args.semente)
+    agora = datetime.now()
+    conn = sqlite3.connect(caminho)
+    conn.execute('PRAGMA journal_mode = WAL'); conn.execute('PRAGMA synchronous = OFF')
+    with conn:
+        conn.execute('DELETE FROM setores'); conn.execute('DELETE FROM status')
+        conn.executemany('INSERT INTO setores (id, nome, ordem) VALUES (?, ?, ?)', [(i, f'Setor {i:02d}', i) for i in range(1, args.setores + 1)])
+        conn.executemany('INSERT INTO status (id, nome, cor) VALUES (?, ?, ?)', [(1, 'Pendente', 'gray'), (2, 'Urgente', 'red'), (3, 'Aguardando cliente', 'orange'), (4, 'Concluído', 'green')])
+        total = args.ativos + args.arquivados
+        def cards():
+            for i in range(total):
+                arquivado = i < args.arquivados  # os mais antigos (ids menores) são os arquivados
+                criado = agora - timedelta(days=(total - i) * 730 / total)
+                prazo = (criado + timedelta(days=rnd.randint(1, 15))).strftime('%Y-%m-%d') if rnd.random() < 0.8 else None
+                yield (f'OS {10000 + i} - {rnd.choice(SERVICOS)}', f'{rnd.choice(SERVICOS)} {rnd.randint(1, 20)}x{rnd.randint(1, 5)}m, acabamento {rnd.choice(["ilhós", "bastão", "refile", "laminação"])}',
+                       rnd.choice(CLIENTES) + f' ({rnd.randint(10, 99)}) 9{rnd.randint(1000, 9999)}-{rnd.randint(1000, 9999)}', criado.strftime('%Y-%m-%d %H:%M:%S'),
+                       rnd.randint(1, args.setores), rnd.randint(1, 4), 'admin', int(arquivado), prazo,
+                       (criado + timedelta(days=rnd.randint(1, 30))).strftime('%Y-%m-%d %H:%M:%S') if arquivado else None)
+        em_lotes(conn, 'INSERT INTO cards (titulo, descricao, cliente, data_criacao, setor_id, status_id, created_by, is_archived, prazo, arquivado_em) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', cards())
+        em_lotes(conn, 'INSERT INTO comentarios (card_id, usuario, texto, data) VALUES (?, ?, ?, ?)',
+                 ((rnd.randint(1, total), 'admin', f'Cliente pediu {rnd.choice(["ajuste de cor", "mais ilhós", "entrega antecipada", "nova arte"])}',
+                   (agora - timedelta(minutes=rnd.randint(0, 500000))).strftime('%Y-%m-%d %H:%M:%S')) for _ in range(total // 10)))
+        # Arquivados (e seus comentários) vão para o arquivo frio, como se tivessem passado por /arquivar
+        migracoes.mover_arquivados(conn)
+        em_lotes(conn, 'INSERT INTO mensagens (usuario, texto, data_envio) VALUES (?, ?, ?)',
+                 ((rnd.choice(['admin', 'ana', 'bruno', 'carla']), f'Mensagem {i} sobre a OS {10000 + rnd.randint(0, total)}', (agora - timedelta(minutes=args.mensagens - i)).strftime('%Y-%m-%d %H:%M:%S'))
+                  for i in range(args.mensagens)))
+        conn.executemany('INSERT INTO materiais (id, nome, unidade, quantidade, minimo) VALUES (?, ?, ?, ?, ?)',
+                         [(i, f'{rnd.choice(MATERIAIS)} {i}', rnd.choice(['m', 'm²', 'Unid', 'L']), 0, rnd.randint(5, 50)) for i in range(1, args.materiais + 1)])
+        def movimentacoes():
+            for _ in range(args.movimentacoes):
+                saida = rnd.random() < 0.8
+                yield (rnd.randint(1, args.materiais), 'SAIDA' if saida else 'ENTRADA', round(rnd.uniform(0.5, 10 if saida else 60), 2), 'admin',
+                       (agora - timedelta(minutes=rnd.randint(0, 365 * 24 * 60))).strftime('%Y-%m-%d %H:%M:%S'))
+        em_lotes(conn, 'INSERT INTO movimentacoes (material_id, tipo, quantidade, usuario, data) VALUES (?, ?, ?, ?, ?)', movimentacoes())
+        # Saldo materializado = livro (como se tudo tivesse passado por registrar_movimentacoes)
+        conn.execute("UPDATE materiais SET quantidade = COALESCE((SELECT SUM(CASE WHEN tipo = 'SAIDA' THEN -quantidade ELSE quantidade END) "
+                     "FROM movimentacoes WHERE material_id = materiais.id), 0)")
+    conn.execute('ANALYZE')
+    conn.close()
+
+# --- CLIENTES SIMULADOS ---
+
+class Medidor:
+    def __init__(self):
+        self.tempos = {}; self.erros = {}; self.trava = threading.Lock()
+
+    def registrar(self, rota, segundos, status):
+        with self.trava:
+            self.tempos.setdefault(rota, []).append(segundos)
+            if status >= 400: self.erros[rota] = self.erros.get(rota, 0) + 1
+
+def percentil(ordenados, p):
+    return ordenados[min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados))) - 1))]
+
+def rodar_clientes(app, args, ids_ativos):
+    medidor = Medidor()
+    fim = time.time() + args.segundos
+    rotas_prontas = threading.Barrier(args.pollers + args.movers + args.chatters + args.gerentes + 1)
+
+    def chamar(cliente, rota, metodo, url, **kw):
+        inicio = time.perf_counter()
+        r = cliente.open(url, method=metodo, **kw)
+        medidor.registrar(rota, time.perf_counter() - inicio, r.status_code)
+        return r
+
+    def cliente_logado():
+        c = app.test_client(); c.post('/login', data={'username': 'admin', 'password': 'admin'})
+        return c
+
+    def ciclo(passo):
+        def rodar(n):
+            c = cliente_logado(); rnd = random.Random(args.semente + n); estado = {}
+            rotas_prontas.wait()
+            while time.time() < fim:
+                passo(c, rnd, estado)
+                if args.pausa: time.sleep(args.pausa)
+        return rodar
+
+    def poller(c, rnd, estado):
+        chamar(c, '/verificar_atualizacao', 'GET', '/verificar_atualizacao')
+        r = chamar(c, '/api/board', 'GET', '/api/board', headers={'If-None-Match': estado.get('etag', '')})
+        if r.status_code == 200: estado['etag'] = r.headers.get('ETag', '')
+        r = chamar(c, '/chat/listar?after_id', 'GET', f"/chat/listar?after_id={estado.get('chat', 0)}")
+        msgs = r.get_json() or []
+        if msgs: estado['chat'] = msgs[-1]['id']
+
+    def mover(c, rnd, estado):
+        chamar(c, '/mover', 'POST', '/mover', json={'id': rnd.choice(ids_ativos), 'setor_id': rnd.randint(1, args.setores)})
+        r = chamar(c, '/api/board/changes', 'GET', f"/api/board/changes?since={estado.get('seq', 0)}")
+        estado['seq'] = (r.get_json() or {}).get('seq', 0)
+
+    def chatter(c, rnd, estado):
+        chamar(c, '/chat/enviar', 'POST', '/chat/enviar', json={'texto': f'bench {rnd.random():.6f}'})
+        chamar(c, '/chat/listar', 'GET', '/chat/listar')
+
+    def gerente(c, rnd, estado):
+        chamar(c, '/', 'GET', '/')
+        chamar(c, '/dashboard', 'GET', '/dashboard')
+        chamar(c, '/api/busca', 'GET', f'/api/busca?q={rnd.choice(CLIENTES).split()[0]}')
+        chamar(c, '/api/arquivados', 'GET', f'/api/arquivados?cliente={rnd.choice(CLIENTES)[:4]}')
+
+    papeis = [(poller, args.pollers), (mover, args.movers), (chatter, args.chatters), (gerente, args.gerentes)]
+    threads = []
+    for passo, qtd in papeis:
+        threads += [threading.Thread(target=ciclo(passo), args=(len(threads) + i,)) for i in range(qtd)]
+    for t in threads: t.start()
+    rotas_prontas.wait()
+    inicio = time.time()
+    for t in threads: t.join()
+    return medidor, time.time() - inicio
+
+def resumo(medidor, duracao):
+    rotas = {}
+    for rota, tempos in sorted(medidor.tempos.items()):
+        ordenados = sorted(tempos)
+        rotas[rota] = {'requisicoes': len(ordenados), 'por_segundo': round(len(ordenados) / duracao, 1), 'erros': medidor.erros.get(rota, 0),
+                       'p50_ms': round(percentil(ordenados, 50) * 1000, 2), 'p95_ms': round(percentil(ordenados, 95) * 1000, 2),
+                       'p99_ms': round(percentil(ordenados, 99) * 1000, 2), 'max_ms': round(ordenados[-1] * 1000, 2)}
+    total = sum(r['requisicoes'] for r in rotas.values())
+    return {'duracao_s': round(duracao, 2), 'requisicoes': total, 'por_segundo': round(total / duracao, 1), 'rotas': rotas}
+
+def commit_atual():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError: return None
+
+if __name__ == '__main__':
+    args = parse_args()
+    pasta = None
+    if args.banco: caminho = os.path.abspath(args.banco)
+    else: pasta = tempfile.mkdtemp(prefix='printflow-bench-'); caminho = os.path.join(pasta, 'bench.db')
+    gerar = not (args.reaproveitar and os.path.exists(caminho))
+    if gerar and os.path.exists(caminho):
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(caminho + sufixo): os.remove(caminho + sufixo)
+
+    # O app lê PRINTFLOW_DB na importação
+    os.environ['PRINTFLOW_DB'] = caminho
+    from app import app, db, inicializar_banco
+    inicializar_banco()
+    tempo_geracao = None
+    if gerar:
+        print(f"Gerando banco sintético em {caminho}...")
+        inicio = time.time(); gerar_banco(caminho, args); tempo_geracao = round(time.time() - inicio, 1)
+        print(f"Banco gerado em {tempo_geracao}s")
+    with app.app_context():
+        db.engine.dispose()  # descarta conexões abertas antes da carga em massa
+        ids_ativos = [i for (i,) in db.session.execute(text('SELECT id FROM cards WHERE is_archived = 0')).all()]
+    if not ids_ativos: sys.exit('Banco sem cards ativos: use --ativos maior que zero.')
+
+    print(f"Rodando {args.segundos}s: {args.pollers} pollers, {args.movers} movers, {args.chatters} chatters, {args.gerentes} gerentes")
+    medidor, duracao = rodar_clientes(app, args, ids_ativos)
+    resultado = resumo(medidor, duracao)
+
+    print(f"\n{'rota':<26}{'req':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'erros':>7}")
+    for rota, r in resultado['rotas'].items():
+        print(f"{rota:<26}{r['requisicoes']:>8}{r['por_segundo']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['erros']:>7}")
+    print(f"{'TOTAL':<26}{resultado['requisicoes']:>8}{resultado['por_segundo']:>9}")
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump({'data': datetime.now().isoformat(timespec='seconds'), 'commit': commit_atual(), 'python': platform.python_version(),
+                   'sqlite': sqlite3.sqlite_version, 'parametros': vars(args), 'geracao_s': tempo_geracao, **resultado}, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados em {args.saida}")
+    if pasta:
+        shutil.rmtree(pasta, ignore_errors=True)
@@ -1,8 +1,10 @@
 import sqlite3
 import os
+import migracoes
+from app import app, db, basedir, inicializar_banco
 
-# Nome do banco
-DB_NAME = 'printflow.db'
+# Nome do banco (o mesmo que o app.py usa)
+DB_NAME = os.path.join(basedir, 'printflow.db')
 
 def criar_banco():
     # Remove o banco antigo se existir para garantir a estrutura nova
@@ -11,68 +13,13 @@ def criar_banco():
         os.remove(DB_NAME)
         print(f"Banco antigo {DB_NAME} removido.")
 
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-
-    # 1. Tabela de Usuários
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS usuarios (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT NOT NULL UNIQUE,
-        senha TEXT NOT NULL,
-        funcao TEXT NOT NULL
-    )
-    ''')
-
-    # 2. Tabela de Setores
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS setores (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome TEXT NOT NULL,
-        ordem INTEGER NOT NULL
-    )
-    ''')
+    # A estrutura vem dos modelos do app.py + migrações (índices inclusos)
+    with app.app_context():
+        db.create_all()
+        migracoes.aplicar(db.engine)
 
-    # 3. Tabela de Status
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS status (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome TEXT NOT NULL,
-        cor TEXT DEFAULT '#CCCCCC'
-    )
-    ''')
-
-    # 4. Tabela de Cards (ATUALIZADA COM OS NOVOS CAMPOS)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS cards (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        titulo TEXT NOT NULL,
-        descricao TEXT,
-        cliente TEXT,
-        imagem_path TEXT,
-        data_criacao TEXT,
-        setor_id INTEGER,
-        status_id INTEGER,
-        created_by TEXT,               -- Novo campo: Quem criou
-        is_archived INTEGER DEFAULT 0, -- Novo campo: Se está arquivado (0=Não, 1=Sim)
-        FOREIGN KEY(setor_id) REFERENCES setores(id),
-        FOREIGN KEY(status_id) REFERENCES status(id)
-    )
-    ''')
-    
-    # 5. Tabela de Mensagens (Caso não tenha sido criada antes via SQLAlchemy)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS mensagens (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        usuario TEXT,
-        texto TEXT,
-        data_envio TEXT
-    )
-    ''')
-
-    conn.commit()
     print(f"Banco de dados {DB_NAME} recriado com nova estrutura.")
-    return conn
+    return sqlite3.connect(DB_NAME)
 
 def popular_dados_iniciais(conn):
     cursor = conn.cursor()
@@ -116,4 +63,5 @@ def popular_dados_iniciais(conn):
 if __name__ == "__main__":
     conexao = criar_banco()
     popular_dados_iniciais(conexao)
+    inicializar_banco()  # Cria o admin padrão com o hash de senha correto
     print("Script concluído.")
\ No newline at end of file
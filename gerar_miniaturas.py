@@ -0,0 +1,32 @@
+import os
+from sqlalchemy import text
+from app import app, db, UPLOAD_FOLDER, VARIANTES_IMAGEM, Image, gerar_variantes, nome_variante, conferir_variantes, registrar_armazenamento
+
+print("--- GERANDO MINIATURAS DAS IMAGENS JÁ ENVIADAS ---")
+
+if Image is None:
+    print("❌ Pillow não está instalado (pip install Pillow).")
+else:
+    sufixos = tuple(f"_{v}" for v in VARIANTES_IMAGEM)
+    geradas = 0; bytes_ = 0; arquivos = 0
+    tamanho = lambda caminho: os.path.getsize(caminho) if os.path.exists(caminho) else None
+    for nome in sorted(os.listdir(UPLOAD_FOLDER)) if os.path.exists(UPLOAD_FOLDER) else []:
+        base = os.path.splitext(nome)[0]
+        if base.endswith(sufixos): continue  # já é uma variante
+        caminhos = [os.path.join(UPLOAD_FOLDER, nome_variante(nome, v)) for v in VARIANTES_IMAGEM]
+        if all(os.path.exists(c) for c in caminhos): continue
+        antes = [tamanho(c) for c in caminhos]
+        gerar_variantes(nome); geradas += 1
+        # Livro de armazenamento: arquivos novos contam, os regravados só pela diferença de tamanho
+        for anterior, depois in zip(antes, map(tamanho, caminhos)):
+            bytes_ += (depois or 0) - (anterior or 0); arquivos += (depois is not None) - (anterior is not None)
+    with app.app_context():
+        registrar_armazenamento(bytes_, arquivos)
+        # O quadro lê imagem_variantes em vez de olhar o disco: reconfere os cards dessas imagens
+        for tabela in ('cards', 'cards_arquivo'):
+            db.session.execute(text(f'UPDATE {tabela} SET imagem_variantes = NULL WHERE imagem_path IS NOT NULL AND NOT imagem_variantes'))
+        conferir_variantes()
+    print(f"✅ Miniaturas geradas para {geradas} imagens.")
+
+print("--- FIM ---")
+input("Pressione ENTER para sair...")
@@ -0,0 +1,294 @@
+"""Migrações versionadas do banco do PrintFlow.
+
+Cada migração tem um número, uma descrição e uma função que recebe a conexão
+sqlite3. A tabela `schema_migracoes` guarda as que já rodaram; aplicar() executa
+só as pendentes, em ordem, cada uma dentro da sua própria transação.
+
+Para criar uma migração nova, acrescente no fim do arquivo:
+
+    @migracao(N, 'O que ela faz')
+    def _nome(conn):
+        conn.execute('...')
+"""
+from datetime import datetime, timedelta
+
+MIGRACOES = []
+
+def migracao(numero, descricao):
+    def registrar(func):
+        MIGRACOES.append((numero, descricao, func))
+        return func
+    return registrar
+
+def _colunas(conn, tabela):
+    return {linha[1] for linha in conn.execute(f'PRAGMA table_info({tabela})')}
+
+def aplicar(engine, log=print):
+    """Aplica as migrações pendentes e devolve a lista dos números aplicados.
+
+    BEGIN IMMEDIATE pega o lock de escrita antes de conferir o que já rodou, então
+    dois processos subindo juntos não aplicam a mesma migração duas vezes."""
+    bruta = engine.raw_connection()
+    conn = bruta.driver_connection
+    isolamento = conn.isolation_level
+    conn.isolation_level = None  # BEGIN/COMMIT manuais: o DDL entra na transação
+    aplicadas = []
+    try:
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_migracoes (numero INTEGER PRIMARY KEY, descricao TEXT, aplicada_em TEXT)')
+        for numero, descricao, func in sorted(MIGRACOES, key=lambda m: m[0]):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('SELECT 1 FROM schema_migracoes WHERE numero = ?', (numero,)).fetchone():
+                    conn.execute('COMMIT'); continue
+                func(conn)
+                conn.execute('INSERT INTO schema_migracoes (numero, descricao, aplicada_em) VALUES (?, ?, ?)',
+                             (numero, descricao, datetime.now().isoformat(timespec='seconds')))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK'); raise
+            aplicadas.append(numero)
+            log(f"Migração {numero:03d} aplicada: {descricao}")
+    finally:
+        conn.isolation_level = isolamento
+        bruta.close()
+    return aplicadas
+
+# --- BUSCA E ARQUIVO FRIO (compartilhado com app.py e benchmark.py) ---
+
+_COMENTARIOS_DO = "(SELECT group_concat(texto, ' ') FROM comentarios WHERE card_id = {0})"
+GATILHOS_BUSCA = {
+    'busca_cards_ins': "AFTER INSERT ON cards BEGIN INSERT INTO busca_cards (rowid, titulo, cliente, descricao, comentarios) "
+                       f"VALUES (new.id, new.titulo, new.cliente, new.descricao, {_COMENTARIOS_DO.format('new.id')}); END",
+    'busca_cards_upd': "AFTER UPDATE OF titulo, cliente, descricao ON cards BEGIN "
+                       "UPDATE busca_cards SET titulo = new.titulo, cliente = new.cliente, descricao = new.descricao WHERE rowid = new.id; END",
+    'busca_cards_del': "AFTER DELETE ON cards BEGIN DELETE FROM busca_cards WHERE rowid = old.id; END",
+    'busca_comentarios_ins': f"AFTER INSERT ON comentarios BEGIN UPDATE busca_cards SET comentarios = {_COMENTARIOS_DO.format('new.card_id')} WHERE rowid = new.card_id; END",
+    'busca_comentarios_upd': f"AFTER UPDATE OF texto ON comentarios BEGIN UPDATE busca_cards SET comentarios = {_COMENTARIOS_DO.format('new.card_id')} WHERE rowid = new.card_id; END",
+    'busca_comentarios_del': f"AFTER DELETE ON comentarios BEGIN UPDATE busca_cards SET comentarios = {_COMENTARIOS_DO.format('old.card_id')} WHERE rowid = old.card_id; END",
+}
+# No arquivo frio só se edita o texto do card e se acrescentam comentários; a mudança
+# de tabela (arquivar/restaurar) cuida da busca por conta própria, em comandos_arquivar/restaurar.
+_COMENTARIOS_ARQUIVO_DO = "(SELECT group_concat(texto, ' ') FROM comentarios_arquivo WHERE card_id = {0})"
+GATILHOS_BUSCA_ARQUIVO = {
+    'busca_cards_arquivo_upd': "AFTER UPDATE OF titulo, cliente, descricao ON cards_arquivo BEGIN "
+                               "UPDATE busca_cards SET titulo = new.titulo, cliente = new.cliente, descricao = new.descricao WHERE rowid = new.id; END",
+    'busca_comentarios_arquivo_ins': f"AFTER INSERT ON comentarios_arquivo BEGIN UPDATE busca_cards SET comentarios = "
+                                     f"{_COMENTARIOS_ARQUIVO_DO.format('new.card_id')} WHERE rowid = new.card_id; END",
+}
+
+COLUNAS_CARD = ('id', 'titulo', 'descricao', 'cliente', 'imagem_path', 'data_criacao', 'setor_id', 'status_id',
+                'created_by', 'is_archived', 'prazo', 'arquivado_em')
+_DDL_CARDS = ('CREATE TABLE {tabela} (id INTEGER NOT NULL PRIMARY KEY{autoincremento}, titulo VARCHAR(100) NOT NULL, descricao TEXT, '
+              'cliente VARCHAR(100), imagem_path TEXT, data_criacao VARCHAR(50), setor_id INTEGER REFERENCES setores (id), '
+              'status_id INTEGER REFERENCES status (id), created_by VARCHAR(100), is_archived BOOLEAN, prazo VARCHAR(20), arquivado_em DATETIME)')
+
+def comandos_arquivar(ids, colunas=COLUNAS_CARD):
+    """SQL que leva os cards `ids` (":ids" expandido ou subconsulta) com os comentários de `cards` para `cards_arquivo`.
+
+    O id continua o mesmo, então a linha da busca (rowid = id) é refeita a partir do arquivo. `colunas` são as
+    comuns às duas tabelas (as de COLUNAS_CARD mais as que migrações seguintes acrescentaram)."""
+    colunas = ', '.join(colunas)
+    return [
+        f'INSERT INTO cards_arquivo ({colunas}) SELECT {colunas} FROM cards WHERE id IN {ids}',
+        f'INSERT INTO comentarios_arquivo (card_id, usuario, texto, data) SELECT card_id, usuario, texto, data FROM comentarios WHERE card_id IN {ids} ORDER BY id',
+        f'DELETE FROM comentarios WHERE card_id IN {ids}',
+        f'DELETE FROM cards WHERE id IN {ids}',  # busca_cards_del tira a linha da busca
+        f"INSERT INTO busca_cards (rowid, titulo, cliente, descricao, comentarios) "
+        f"SELECT id, titulo, cliente, descricao, {_COMENTARIOS_ARQUIVO_DO.format('cards_arquivo.id')} FROM cards_arquivo WHERE id IN {ids}",
+    ]
+
+def comandos_restaurar(ids, colunas=COLUNAS_CARD):
+    """O caminho inverso de comandos_arquivar: volta para `cards` já como ativo (is_archived = 0, sem arquivado_em)."""
+    valores = ', '.join({'is_archived': '0', 'arquivado_em': 'NULL'}.get(c, c) for c in colunas)
+    colunas = ', '.join(colunas)
+    return [
+        f'DELETE FROM busca_cards WHERE rowid IN {ids}',  # busca_cards_ins recria com os comentários
+        f'INSERT INTO comentarios (card_id, usuario, texto, data) SELECT card_id, usuario, texto, data FROM comentarios_arquivo WHERE card_id IN {ids} ORDER BY id',
+        f'INSERT INTO cards ({colunas}) SELECT {valores} FROM cards_arquivo WHERE id IN {ids}',
+        f'DELETE FROM comentarios_arquivo WHERE card_id IN {ids}',
+        f'DELETE FROM cards_arquivo WHERE id IN {ids}',
+    ]
+
+def mover_arquivados(conn):
+    """Leva para o arquivo frio todo card ainda em `cards` com is_archived = 1 (migração e carga do benchmark)."""
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS _arquivar (id INTEGER PRIMARY KEY)')
+    conn.execute('INSERT INTO _arquivar SELECT id FROM cards WHERE is_archived = 1')
+    colunas = sorted(_colunas(conn, 'cards') & _colunas(conn, 'cards_arquivo'))
+    for sql in comandos_arquivar('(SELECT id FROM _arquivar)', colunas):
+        conn.execute(sql)
+    conn.execute('DROP TABLE _arquivar')
+
+# --- MIGRAÇÕES ---
+
+@migracao(1, 'Colunas legadas (acesso_estoque, prazo) e is_archived sem NULL')
+def _colunas_legadas(conn):
+    # Substitui atualizar_banco.py / atualizar_prazo.py / atualizar_tudo.py antigos
+    if 'acesso_estoque' not in _colunas(conn, 'usuarios'):
+        conn.execute('ALTER TABLE usuarios ADD COLUMN acesso_estoque BOOLEAN DEFAULT 0')
+    if 'prazo' not in _colunas(conn, 'cards'):
+        conn.execute('ALTER TABLE cards ADD COLUMN prazo VARCHAR(20)')
+    # O quadro filtra is_archived = 0 pelo índice; NULL ficaria de fora
+    conn.execute('UPDATE cards SET is_archived = 0 WHERE is_archived IS NULL')
+
+@migracao(2, 'Índices das consultas do quadro, dashboard, anotações, estoque e eventos')
+def _indices_quentes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_board ON cards (is_archived, setor_id, prazo)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_status ON cards (is_archived, status_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_prazo ON cards (is_archived, prazo)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_comentarios_card ON comentarios (card_id, data)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_movimentacoes_material_data ON movimentacoes (material_id, data)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_alteracoes_tipo ON alteracoes (tipo, id)')
+    conn.execute('ANALYZE')
+
+@migracao(3, 'Índice de cards.imagem_path para a contagem de referências das imagens')
+def _indice_imagem(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_imagem ON cards (imagem_path)')
+
+@migracao(4, 'Livro de armazenamento dos uploads (linha única, conferida na primeira subida)')
+def _livro_armazenamento(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS armazenamento (id INTEGER PRIMARY KEY, bytes BIGINT NOT NULL DEFAULT 0, arquivos INTEGER NOT NULL DEFAULT 0, reconciliado_em DATETIME)')
+    conn.execute('INSERT OR IGNORE INTO armazenamento (id, bytes, arquivos) VALUES (1, 0, 0)')
+
+@migracao(5, 'Tabela de tarefas em segundo plano (limpeza de imagens, reconciliação, exportação)')
+def _tarefas(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS tarefas (id INTEGER PRIMARY KEY, tipo VARCHAR(50) NOT NULL, status VARCHAR(20) NOT NULL, '
+                 'parametros TEXT, progresso INTEGER NOT NULL DEFAULT 0, total INTEGER, cursor INTEGER, resultado TEXT, erro TEXT, '
+                 'dono VARCHAR(100), criado_por VARCHAR(100), criado_em DATETIME, atualizado_em DATETIME)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_tarefas_status ON tarefas (status)')
+
+@migracao(6, 'Índice FTS5 da busca (título, cliente, descrição e comentários), mantido por gatilhos')
+def _busca_fts(conn):
+    # rowid = cards.id; a coluna comentarios junta o texto de todos os comentários do card
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS busca_cards USING fts5(titulo, cliente, descricao, comentarios, "
+                 "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+    # Um execute por gatilho: executescript faria COMMIT no meio da transação da migração
+    for nome, corpo in GATILHOS_BUSCA.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {nome} {corpo}')
+    conn.execute('DELETE FROM busca_cards')
+    conn.execute(f"INSERT INTO busca_cards (rowid, titulo, cliente, descricao, comentarios) "
+                 f"SELECT id, titulo, cliente, descricao, {_COMENTARIOS_DO.format('cards.id')} FROM cards")
+
+@migracao(7, 'cards.arquivado_em (preenchida pelo log de alterações) e índices do arquivo')
+def _arquivado_em(conn):
+    if 'arquivado_em' not in _colunas(conn, 'cards'):
+        conn.execute('ALTER TABLE cards ADD COLUMN arquivado_em DATETIME')
+    # O que ainda estiver no log dá a data real; arquivados mais antigos que o log ficam sem data
+    conn.execute("""UPDATE cards SET arquivado_em = (
+                        SELECT MAX(a.data) FROM alteracoes a
+                        WHERE a.tipo = 'board' AND json_extract(a.dados, '$.op') = 'arquivar' AND json_extract(a.dados, '$.card_id') = cards.id)
+                    WHERE is_archived = 1 AND arquivado_em IS NULL""")
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_arquivo ON cards (is_archived, arquivado_em)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_criador ON cards (is_archived, created_by)')
+
+@migracao(8, 'Chave de idempotência das movimentações de estoque (índice único)')
+def _chave_movimentacao(conn):
+    if 'chave' not in _colunas(conn, 'movimentacoes'):
+        conn.execute('ALTER TABLE movimentacoes ADD COLUMN chave VARCHAR(64)')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS ix_movimentacoes_chave ON movimentacoes (chave)')
+
+@migracao(9, 'Resumo diário de consumo (SAÍDAS) por material, mantido por gatilhos, com carga do histórico')
+def _consumo_diario(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS consumo_diario (material_id INTEGER NOT NULL, dia VARCHAR(10) NOT NULL, '
+                 'quantidade FLOAT NOT NULL DEFAULT 0, PRIMARY KEY (material_id, dia))')
+    gatilhos = {
+        'consumo_mov_ins': "AFTER INSERT ON movimentacoes WHEN new.tipo = 'SAIDA' BEGIN "
+                           "INSERT INTO consumo_diario (material_id, dia, quantidade) VALUES (new.material_id, date(new.data), new.quantidade) "
+                           "ON CONFLICT (material_id, dia) DO UPDATE SET quantidade = quantidade + excluded.quantidade; END",
+        'consumo_mov_del': "AFTER DELETE ON movimentacoes WHEN old.tipo = 'SAIDA' BEGIN "
+                           "UPDATE consumo_diario SET quantidade = quantidade - old.quantidade WHERE material_id = old.material_id AND dia = date(old.data); END",
+        'consumo_material_del': "AFTER DELETE ON materiais BEGIN DELETE FROM consumo_diario WHERE material_id = old.id; END",
+    }
+    for nome, corpo in gatilhos.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {nome} {corpo}')
+    conn.execute('DELETE FROM consumo_diario')
+    conn.execute("INSERT INTO consumo_diario (material_id, dia, quantidade) "
+                 "SELECT material_id, date(data), SUM(quantidade) FROM movimentacoes WHERE tipo = 'SAIDA' GROUP BY material_id, date(data)")
+
+@migracao(10, 'Arquivo frio: cards arquivados e seus comentários em tabelas próprias; cards com AUTOINCREMENT')
+def _arquivo_frio(conn):
+    conn.execute(_DDL_CARDS.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS').format(tabela='cards_arquivo', autoincremento=''))
+    conn.execute('CREATE TABLE IF NOT EXISTS comentarios_arquivo (id INTEGER NOT NULL PRIMARY KEY, card_id INTEGER NOT NULL REFERENCES cards_arquivo (id), '
+                 'usuario VARCHAR(100), texto TEXT, data DATETIME)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_arquivo_data ON cards_arquivo (arquivado_em)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_arquivo_setor ON cards_arquivo (setor_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_arquivo_criador ON cards_arquivo (created_by)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_arquivo_imagem ON cards_arquivo (imagem_path)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_comentarios_arquivo_card ON comentarios_arquivo (card_id, data)')
+    for nome, corpo in GATILHOS_BUSCA_ARQUIVO.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {nome} {corpo}')
+    # O id do card arquivado segue valendo (busca, links, restauração): cards não pode reaproveitar
+    # o maior id quando ele sai para o arquivo, então a tabela é refeita com AUTOINCREMENT.
+    ddl = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'cards'").fetchone()[0]
+    if 'AUTOINCREMENT' not in ddl.upper():
+        colunas = ', '.join(COLUNAS_CARD)
+        conn.execute(_DDL_CARDS.format(tabela='cards_nova', autoincremento=' AUTOINCREMENT'))
+        conn.execute(f'INSERT INTO cards_nova ({colunas}) SELECT {colunas} FROM cards')
+        conn.execute('DROP TABLE cards')  # leva junto os índices e os gatilhos da busca
+        conn.execute('ALTER TABLE cards_nova RENAME TO cards')
+        conn.execute('CREATE INDEX ix_cards_board ON cards (is_archived, setor_id, prazo)')
+        conn.execute('CREATE INDEX ix_cards_status ON cards (is_archived, status_id)')
+        conn.execute('CREATE INDEX ix_cards_prazo ON cards (is_archived, prazo)')
+        conn.execute('CREATE INDEX ix_cards_imagem ON cards (imagem_path)')
+        for nome, corpo in GATILHOS_BUSCA.items():
+            if ' ON cards ' in corpo: conn.execute(f'CREATE TRIGGER {nome} {corpo}')
+    # Índices do arquivo (migração 007) não servem mais a `cards`
+    conn.execute('DROP INDEX IF EXISTS ix_cards_arquivo')
+    conn.execute('DROP INDEX IF EXISTS ix_cards_criador')
+    mover_arquivados(conn)
+
+# Formato em que o SQLAlchemy grava DateTime no SQLite: texto ISO que ordena certo no índice
+_DATA_HORA = '%Y-%m-%d %H:%M:%S.%f'
+
+def _ler_legado(texto, referencia):
+    """'dd/mm HH:MM' (sem ano) -> datetime no ano que deixa a data <= referência; aceita também com ano."""
+    try: return datetime.strptime(texto, '%d/%m/%Y %H:%M')
+    except ValueError: pass
+    try: sem_ano = datetime.strptime(texto, '%d/%m %H:%M')
+    except ValueError: return None
+    for ano in range(referencia.year, referencia.year - 5, -1):  # 29/02 só cabe em ano bissexto
+        try: quando = sem_ano.replace(year=ano)
+        except ValueError: continue
+        if quando <= referencia: return quando
+    return None
+
+@migracao(11, 'prazo, data_criacao e data_envio como DATE/DATETIME (converte os textos antigos) e índices de período')
+def _datas_nativas(conn):
+    agora = datetime.now()
+    for tabela in ('cards', 'cards_arquivo'):
+        # prazo vinha do <input type="date"> (YYYY-MM-DD) ou vazio; dd/mm/aaaa por garantia
+        conn.execute(f"UPDATE {tabela} SET prazo = substr(prazo, 7, 4) || '-' || substr(prazo, 4, 2) || '-' || substr(prazo, 1, 2) "
+                     "WHERE prazo GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]'")
+        conn.execute(f"UPDATE {tabela} SET prazo = date(prazo) WHERE prazo IS NOT NULL AND prazo <> date(prazo)")
+        conn.execute(f"UPDATE {tabela} SET prazo = NULL WHERE prazo IS NOT NULL AND date(prazo) IS NULL")
+        # data_criacao era 'dd/mm HH:MM': o ano é o que não passa do arquivamento (arquivados) ou de agora
+        linhas = conn.execute(f"SELECT id, data_criacao, arquivado_em FROM {tabela} WHERE data_criacao LIKE '%/%'").fetchall()
+        novas = []
+        for card_id, texto, arquivado_em in linhas:
+            try: referencia = datetime.fromisoformat(arquivado_em) if arquivado_em else agora
+            except ValueError: referencia = agora
+            quando = _ler_legado(texto, referencia)
+            novas.append((quando.strftime(_DATA_HORA) if quando else None, card_id))
+        conn.executemany(f'UPDATE {tabela} SET data_criacao = ? WHERE id = ?', novas)
+    # Chat guardava só 'HH:MM'. Do mais novo para o mais antigo, cada vez que o horário "sobe"
+    # virou o dia: melhor estimativa possível sem a data (conversas com mais de 24h de silêncio
+    # ficam com o dia errado, mas a ordem e a hora exibida se mantêm).
+    dia, anterior, novas = agora.date(), agora.strftime('%H:%M'), []
+    for msg_id, hora in conn.execute("SELECT id, data_envio FROM mensagens WHERE data_envio GLOB '[0-9][0-9]:[0-9][0-9]' ORDER BY id DESC"):
+        if hora > anterior: dia -= timedelta(days=1)
+        anterior = hora
+        novas.append((f'{dia.isoformat()} {hora}:00.000000', msg_id))
+        if len(novas) >= 10000: conn.executemany('UPDATE mensagens SET data_envio = ? WHERE id = ?', novas); novas = []
+    conn.executemany('UPDATE mensagens SET data_envio = ? WHERE id = ?', novas)
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_criacao ON cards (data_criacao)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_mensagens_data ON mensagens (data_envio)')
+
+@migracao(12, 'imagem_variantes em cards e cards_arquivo (o app preenche na subida, olhando o disco uma vez)')
+def _imagem_variantes(conn):
+    # NULL = ainda não conferido; app.conferir_variantes() resolve, já que só o app sabe onde ficam os uploads
+    for tabela in ('cards', 'cards_arquivo'):
+        if 'imagem_variantes' not in _colunas(conn, tabela):
+            conn.execute(f'ALTER TABLE {tabela} ADD COLUMN imagem_variantes BOOLEAN')
+
+@migracao(13, 'Índice NOCASE de cards_arquivo.cliente para o filtro por prefixo do arquivo')
+def _cliente_arquivo(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_cards_arquivo_cliente ON cards_arquivo (cliente COLLATE NOCASE)')
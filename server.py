@@ -1,13 +1,20 @@
 from waitress import serve
-from app import app # Importa o seu app Flask
+from app import app, inicializar_banco, iniciar_segundo_plano # Importa o seu app Flask
 
 # Configuração
 HOST = '0.0.0.0' # Permite acesso de outros PCs
 PORT = 8080      # Porta de acesso (pode ser 80, 5000, 8080)
+# Cada tela aberta mantém uma conexão de eventos (/eventos) presa a uma thread,
+# então o número de threads precisa cobrir as telas + as requisições normais.
+THREADS = 64
 
 print(f"--- PrintFlow Iniciado ---")
 print(f"Acesse no navegador através do IP deste computador na porta {PORT}")
 print(f"Exemplo: http://192.168.X.X:{PORT}")
 print("Pressione Ctrl+C para parar o servidor.")
 
-serve(app, host=HOST, port=PORT, threads=6, max_request_body_size=500*1024*1024)
\ No newline at end of file
+# Cria tabelas novas e aplica as migrações pendentes antes de atender
+inicializar_banco()
+iniciar_segundo_plano()
+
+serve(app, host=HOST, port=PORT, threads=THREADS, connection_limit=200, max_request_body_size=500*1024*1024)
\ No newline at end of file
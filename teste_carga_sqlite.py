@@ -0,0 +1,83 @@
+"""Teste de carga do SQLite: leitura e escrita misturadas, antes e depois do ajuste.
+
+Cria um banco temporário com o esquema do app, sobe threads leitoras (consulta do
+quadro) e escritoras (mover card + mensagem de chat, como /mover e /chat/enviar) e
+mede operações por segundo e quantos "database is locked" aconteceram, primeiro com
+o SQLite padrão e depois com os pragmas/pool de app.config.
+
+Uso: python teste_carga_sqlite.py [--segundos 10] [--leitores 6] [--escritores 2]
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from app import app, db, configurar_sqlite
+
+CONSULTA_QUADRO = text("SELECT * FROM cards WHERE is_archived = 0 AND setor_id IN (1, 2, 3, 4, 5) "
+                       "ORDER BY CASE WHEN prazo IS NULL THEN 1 ELSE 0 END, prazo, id")
+
+def preparar_banco(caminho, cards=3000):
+    motor = create_engine('sqlite:///' + caminho)
+    db.metadata.create_all(motor)
+    with motor.begin() as conn:
+        conn.execute(text("INSERT INTO setores (nome, ordem) VALUES ('S1',1),('S2',2),('S3',3),('S4',4),('S5',5)"))
+        conn.execute(text("INSERT INTO status (nome, cor) VALUES ('Fila','blue')"))
+        conn.execute(text("INSERT INTO cards (titulo, setor_id, status_id, is_archived, prazo) VALUES (:t, :s, 1, :a, :p)"),
+                     [{'t': f'OS {i}', 's': i % 5 + 1, 'a': i % 10 != 0, 'p': f'2026-{i % 12 + 1:02d}-{i % 28 + 1:02d}'} for i in range(cards)])
+    motor.dispose()
+
+def rodar(caminho, otimizado, segundos, leitores, escritores):
+    opcoes = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS']) if otimizado else {}
+    motor = create_engine('sqlite:///' + caminho, **opcoes)
+    if otimizado:
+        event.listen(motor, 'connect', configurar_sqlite)
+    contagem = {'leituras': 0, 'escritas': 0, 'travado': 0}
+    trava = threading.Lock()
+    fim = time.time() + segundos
+
+    def somar(chave):
+        with trava: contagem[chave] += 1
+
+    def ler():
+        while time.time() < fim:
+            try:
+                with motor.connect() as conn: conn.execute(CONSULTA_QUADRO).fetchall()
+                somar('leituras')
+            except OperationalError: somar('travado')
+
+    def escrever():
+        while time.time() < fim:
+            try:
+                with motor.begin() as conn:
+                    conn.execute(text('UPDATE cards SET setor_id = :s WHERE id = :id'), {'s': random.randint(1, 5), 'id': random.randint(1, 3000)})
+                    conn.execute(text("INSERT INTO mensagens (usuario, texto, data_envio) VALUES ('carga', 'oi', datetime('now'))"))
+                somar('escritas')
+            except OperationalError: somar('travado')
+
+    threads = [threading.Thread(target=ler) for _ in range(leitores)] + [threading.Thread(target=escrever) for _ in range(escritores)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    motor.dispose()
+    return {k: round(v / segundos, 1) if k != 'travado' else v for k, v in contagem.items()}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--leitores', type=int, default=6)
+    parser.add_argument('--escritores', type=int, default=2)
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp(prefix='printflow-carga-')
+    try:
+        for nome, otimizado in (('padrão', False), ('otimizado', True)):
+            caminho = os.path.join(pasta, f'{nome}.db')
+            preparar_banco(caminho)
+            r = rodar(caminho, otimizado, args.segundos, args.leitores, args.escritores)
+            print(f"{nome:>10}: {r['leituras']:>8} leituras/s  {r['escritas']:>8} escritas/s  {r['travado']:>5} 'database is locked'")
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)